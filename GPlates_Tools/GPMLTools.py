@@ -21,669 +21,732 @@
 #### GPML Tools ####
 
 import pygplates as pgp
-import datetime
 import time
 import os
 import numpy as np
 
 
-# Filter GPML by selected criteria and output new GPML file of filtered data
-def filterGPML(**kwargs):
+# Feature types understood by the feature type filter, keyed by their filterGPML codes
+FEATURE_TYPE_CODES = {"ISO": "Isochron", "MOR": "MidOceanRidge", "PCB": "PassiveContinentalBoundary"}
 
-    # Start the clock
-    start = time.time()
+GEOMETRY_TYPES = ["PolylineOnSphere", "PolygonOnSphere", "PointOnSphere", "MultiPointOnSphere"]
 
-    filterProperties = ["inputFile", "outputFile", "filterSequence", "rPlateID", "cPlateID", "ageAppearWindow", "ageDisappearWindow",
-                        "ageExistsWindow", "boundingBox", "featureType", "geometryType", "featureID", "featureName", "feature_truncate_age", "inverse", "cascade"]
 
-    # Process supplied arguments and assign values to variables
 
-    # Inverse is set to False by default
-    inverse = False
+#### Feature index ####
 
-    # Cascade is set to True  by default
-    cascade = True
+# Columnar view of a feature collection. Each column (plate IDs, valid times, names, ...) is read from the features
+# the first time a filter asks for it, so filters can then be evaluated as array operations.
+class FeatureIndex(object):
 
-    for parameter, value in kwargs.items():
+    def __init__(self, features):
 
-        if parameter in filterProperties:
-            if parameter == filterProperties[0]:
-                inputFile = value
-            elif parameter == filterProperties[1]:
-                outputFile = value
-            elif parameter == filterProperties[2]:
-                filterSequence = value
-            elif parameter == filterProperties[3]:
-                rPlateID = value
-            elif parameter == filterProperties[4]:
-                cPlateID = value
-            elif parameter == filterProperties[5]:
-                ageAppearWindow = value
-            elif parameter == filterProperties[6]:
-                ageDisappearWindow = value
-            elif parameter == filterProperties[7]:
-                ageExistsWindow = value
-
-
-                if ageExistsWindow[1] > ageExistsWindow[0]:
-                    print " "
-                    print "ERROR - Age exists window end age older than begin age: " + str(ageExistsWindow[1])
-                    
-
-            elif parameter == filterProperties[8]:
-                boundingBox = value
-
-                if pgp.LatLonPoint.is_valid_longitude(boundingBox[0]) is False:
-                    print " "
-                    print "ERROR - Bounding box longitude is not valid: " + str(boundingBox[0])
-                    
-                if pgp.LatLonPoint.is_valid_longitude(boundingBox[1]) is False:
-                    print " "
-                    print "ERROR - Bounding box longitude is not valid: " + str(boundingBox[1])
-                    
-                if pgp.LatLonPoint.is_valid_latitude(boundingBox[2]) is False:
-                    print " "
-                    print "ERROR - Bounding box latitude is not valid: " + str(boundingBox[2])
-                    
-                if pgp.LatLonPoint.is_valid_latitude(boundingBox[3]) is False:
-                    print " "
-                    print "ERROR - Bounding box latitude is not valid: " + str(boundingBox[3])
-                    
-
-            elif parameter == filterProperties[9]:
-                featureTemp = value
-                featureType = []
-
-                if "ALL" in featureTemp:
-                    featureType = ["Isochron", "MidOceanRidge", "PassiveContinentalBoundary"]
-                if "ISO" in featureTemp:
-                    featureType.append("Isochron")
-                if "MOR" in featureTemp:
-                    featureType.append("MidOceanRidge")
-                if "PCB" in featureTemp:
-                    featureType.append("PassiveContinentalBoundary")
-
-            elif parameter == filterProperties[10]:
-                geometryType = value
-
-                if "ALL" in geometryType:
-                    geometryType = ["PolylineOnSphere", "PolygonOnSphere", "PointOnSphere", "MultiPointOnSphere"]
-
-            elif parameter == filterProperties[11]:
-                featureID = value
-            elif parameter == filterProperties[12]:
-                featureName = value
-            elif parameter == filterProperties[13]:
-                feature_truncate_age = value
-            elif parameter == filterProperties[14]:
-                inverse = value
-            elif parameter == filterProperties[15]:
-                cascade = value
+        self.features = list(features)
+        self._columns = {}
 
+    def __len__(self):
 
-        else:
-            print " "
-            print "ERROR - Filter criteria not found: " + str(parameter)
-            print " "
-            
+        return len(self.features)
 
+    def column(self, name):
 
-    date = datetime.date.today()
+        if name not in self._columns:
+            self._columns[name] = getattr(self, "_build_" + name)()
 
-    #if inputFile != "none":
-        #output = pgp.FeatureCollection()
+        return self._columns[name]
 
-    featureCollection = pgp.FeatureCollectionFileFormatRegistry()
+    def _build_plate_id(self):
 
-    print " "
-    print "--------------------------------------------"
-    print " ### GPMLTools - filterGPML ###"
+        return np.array([_plateID(feature, conjugate=False) for feature in self.features], dtype=np.int64)
 
-    # Check for existing output directory and create it if not found
-    if not os.path.exists("output"):
-        os.makedirs("output")
-        print " "
-        print "Housekeeping:"
-        print "    No output folder found. Folder 'output' created."
+    def _build_conjugate_plate_id(self):
 
-    # Check for existing output file with same name and remove if found
-    if os.path.isfile("output/output.gpml"):
-        os.remove("output/output.gpml")
-        print " "
-        print "Housekeeping:"
-        print "    Previous 'output.gpml' found in destination folder. File removed for new filter sequence."
+        return np.array([_plateID(feature, conjugate=True) for feature in self.features], dtype=np.int64)
 
+    def _build_valid_time(self):
 
-    try:
-        feature = featureCollection.read(inputFile)
-        feature1 = featureCollection.read(inputFile)
-        print " "
-        print "Data handling:"
-        print "    Successfully loaded data file:  '" + str(inputFile) + "'"
-        print "       - File contains " + str(len(feature)) + " features."
+        times = np.array([feature.get_valid_time() for feature in self.features], dtype=np.float64)
 
-    except pgp.OpenFileForReadingError:
-        print " "
-        print("    ERROR - File read error in: '" + inputFile + "'. Is this a valid GPlates file?")
-        
-    except pgp.FileFormatNotSupportedError:
-        print " "
-        print("    ERROR - File format not supported: '" + inputFile + "'. Please check the file name and try again")
-        
+        return times.reshape(len(self.features), 2)
 
+    def _build_feature_type(self):
 
+        return np.array([str(feature.get_feature_type()) for feature in self.features], dtype=str)
 
-    #Filter data
+    def _build_geometry_type(self):
 
-    print " "
-    print "Filter sequence:"
+        return np.array([_geometryType(feature) for feature in self.features], dtype=str)
 
-    previousFilter = 0
+    def _build_feature_id(self):
 
-    f1_result = pgp.FeatureCollection()
-    f2_result = pgp.FeatureCollection()
-    f3_result = pgp.FeatureCollection()
-    f4_result = pgp.FeatureCollection()
-    f5_result = pgp.FeatureCollection()
-    f6_result = pgp.FeatureCollection()
-    f7_result = pgp.FeatureCollection()
-    f8_result = pgp.FeatureCollection()
-    f9_result = pgp.FeatureCollection()
-    f10_result = pgp.FeatureCollection()
-    f11a_result = pgp.FeatureCollection()
-    f11b_result = pgp.FeatureCollection()
+        return np.array([str(feature.get_feature_id()).lower() for feature in self.features], dtype=str)
 
+    def _build_name(self):
 
-    for filter_ in filterSequence:
+        return np.array([feature.get_name().lower() for feature in self.features], dtype=str)
 
-        if previousFilter == 0:
-            data_ = feature
-        elif previousFilter == 1:
-            data_ = f1_result
-        elif previousFilter == 2:
-            data_ = f2_result
-        elif previousFilter == 3:
-            data_ = f3_result
-        elif previousFilter == 4:
-            data_ = f4_result
-        elif previousFilter == 5:
-            data_ = f5_result
-        elif previousFilter == 6:
-            data_ = f6_result
-        elif previousFilter == 7:
-            data_ = f7_result
-        elif previousFilter == 8:
-            data_ = f8_result
-        elif previousFilter == 9:
-            data_ = f9_result
-        elif previousFilter == 10:
-            data_ = f10_result
-        elif previousFilter == 11:
-            data_ = f11_result
+    def _build_centre_line(self):
 
+        # Centre line vertices of every feature as flat arrays with per-feature offsets
+        vertices = [_centreLineVertices(feature) for feature in self.features]
+        offsets = np.concatenate(([0], np.cumsum([len(lat_lon) for lat_lon in vertices]))).astype(np.int64)
+        lat_lon = np.concatenate(vertices) if vertices else np.empty((0, 2))
 
+        return lat_lon[:, 0], lat_lon[:, 1], offsets
 
-        # Filter by reconstruction plate ID
-        if filter_ == 1:
 
-            for feature in data_:
+def _plateID(feature, conjugate):
 
-                if cascade == False:
+    plate_id = feature.get_conjugate_plate_id(None) if conjugate else feature.get_reconstruction_plate_id(None)
 
-                    for property in feature:
+    # Missing plate IDs never match a plate ID filter, inverse or not
+    return -1 if plate_id is None else int(plate_id)
 
-                        filter_property = property.get_name()
 
-                        if filter_property.get_name() == "reconstructionPlateId":
-                            selected_filter_property = property.get_value()
+def _geometryType(feature):
 
-                            for property in feature:
+    geometry = feature.get_geometry()
 
-                                filter_property = property.get_name()
+    return "" if geometry is None else type(geometry).__name__
 
-                                if filter_property.get_name() == "conjugatePlateId":
-                                    second_filter_property = property.get_value()
 
-                                    if inverse == False:
-                         
-                                        # Isolate criteria match and process
-                                        if str(selected_filter_property) == str(rPlateID[0]) and str(second_filter_property) == str(cPlateID[0]):
+def _centreLineVertices(feature):
 
-                                            # Append filtered data to associated Feature Collection
-                                            f1_result.add(feature)
+    vertices = [geometry.to_lat_lon_array() for geometry in feature.get_geometries(pgp.PropertyName.create_gpml("centerLineOf"))]
 
-                                    elif inverse == True:
+    return np.concatenate(vertices) if vertices else np.empty((0, 2))
 
-                                        if int(str(selected_filter_property)) not in rPlateID or int(str(second_filter_property)) not in cPlateID:
 
-                                            # Append filtered data to associated Feature Collection
-                                            f1_result.add(feature)
 
+#### Filter predicates ####
 
+# Base class of the composable filters. Each predicate selects features with a vectorised evaluation on a
+# FeatureIndex (evaluate, returning a boolean mask over the requested rows) and an equivalent scalar test on a single
+# feature (matches). cost is the relative cost of evaluating one feature, used by planFilters.
+class Predicate(object):
 
-                elif cascade == True:
+    cost = 1.0
 
-                    for property in feature:
+    def evaluate(self, index, rows):
 
-                        filter_property = property.get_name()
+        raise NotImplementedError
 
-                        if filter_property.get_name() == "reconstructionPlateId":
-                            selected_filter_property = property.get_value()
+    def matches(self, feature):
 
-                            if inverse == False:
+        raise NotImplementedError
 
-                                for plateID in rPlateID:
+    def describe(self):
 
-                                    if str(selected_filter_property) == str(plateID):
+        return self.__class__.__name__
 
-                                        # Append filtered data to associated Feature Collection
-                                        f1_result.add(feature)
 
-                            elif inverse == True:
+# Reconstruction and / or conjugate plate ID. If both lists are given a feature must match both; inverse selects the
+# features that do not match instead.
+class PlateID(Predicate):
 
-                                if int(str(selected_filter_property)) not in rPlateID:
-        							
-        							# Append filtered data to associated Feature Collection
-                                    f1_result.add(feature)
+    def __init__(self, plateIDs=None, conjugatePlateIDs=None, inverse=False):
 
-                        
+        if plateIDs is None and conjugatePlateIDs is None:
+            raise ValueError("PlateID needs plateIDs and / or conjugatePlateIDs")
 
-            if cascade == False:
-                print "Oooooh, you found the secret command..."
-                print " "
-                print "    1. Filtering data by reconstruction plate ID: " + str(rPlateID) + " and conjugate plate ID: " + str(cPlateID)
-                print "       - Found " + str(len(f1_result)) + " feature(s)."
+        self.plateIDs = None if plateIDs is None else [int(plate_id) for plate_id in plateIDs]
+        self.conjugatePlateIDs = None if conjugatePlateIDs is None else [int(plate_id) for plate_id in conjugatePlateIDs]
+        self.inverse = inverse
 
-                cascade = True
+    def evaluate(self, index, rows):
 
-            else:
+        present = np.ones(len(rows), dtype=bool)
+        match = np.ones(len(rows), dtype=bool)
+
+        if self.plateIDs is not None:
+            plate_id = index.column("plate_id")[rows]
+            present &= plate_id >= 0
+            match &= np.isin(plate_id, self.plateIDs)
+
+        if self.conjugatePlateIDs is not None:
+            conjugate_plate_id = index.column("conjugate_plate_id")[rows]
+            present &= conjugate_plate_id >= 0
+            match &= np.isin(conjugate_plate_id, self.conjugatePlateIDs)
+
+        return present & (match != self.inverse)
+
+    def matches(self, feature):
+
+        present = True
+        match = True
+
+        if self.plateIDs is not None:
+            plate_id = _plateID(feature, conjugate=False)
+            present = present and plate_id >= 0
+            match = match and plate_id in self.plateIDs
+
+        if self.conjugatePlateIDs is not None:
+            conjugate_plate_id = _plateID(feature, conjugate=True)
+            present = present and conjugate_plate_id >= 0
+            match = match and conjugate_plate_id in self.conjugatePlateIDs
 
-                print " "
-                print "    1. Filtering data by reconstruction plate ID(s): " + str(rPlateID)
-                print "       - Found " + str(len(f1_result)) + " feature(s)."
+        return present and match != self.inverse
 
-            print " "
+    def describe(self):
 
-            previousFilter = 1
+        text = []
 
+        if self.plateIDs is not None:
+            text.append("reconstruction plate ID(s): " + str(self.plateIDs))
+        if self.conjugatePlateIDs is not None:
+            text.append("conjugate plate ID(s): " + str(self.conjugatePlateIDs))
 
-        # Filter by conjugate plate ID
-        if filter_ == 2:
+        return "Filtering data by " + " and ".join(text) + (" (inverse)" if self.inverse else "")
 
-            for feature in data_:
-                for property in feature:
 
-                    filter_property = property.get_name()
+# Age window [oldest, youngest] in Ma. mode "appear" / "disappear" select features whose begin / end time lies in the
+# window, "exists" features that exist within it. "DP" (distant past) and "DF" (distant future) may be used as ages.
+class AgeWindow(Predicate):
 
-                    if filter_property.get_name() == "conjugatePlateId":
-                        selected_filter_property = property.get_value()
+    MODES = ["appear", "disappear", "exists"]
 
-                        # Isolate criteria match and process
-                        if inverse == False:
+    def __init__(self, window, mode="exists"):
 
-                            for plateID in cPlateID:
+        if mode not in self.MODES:
+            raise ValueError("AgeWindow mode must be one of " + str(self.MODES) + ": " + str(mode))
 
-                                if str(selected_filter_property) == str(plateID):
+        self.window = [_age(age) for age in window]
+        self.mode = mode
 
-                                    # Append filtered data to associated Feature Collection
-                                    f2_result.add(feature)
+    def evaluate(self, index, rows):
 
-                        elif inverse == True:
+        valid_time = index.column("valid_time")[rows]
 
-                            if int(str(selected_filter_property)) not in cPlateID:
-                                
-                                # Append filtered data to associated Feature Collection
-                                f2_result.add(feature)
+        return self._inWindow(valid_time[:, 0], valid_time[:, 1])
 
-            print "    2. Filtering data by conjugate plate ID(s): " + str(cPlateID)
-            print "       - Found " + str(len(f2_result)) + " feature(s)."
-            print " "
+    def matches(self, feature):
 
-            previousFilter = 2
+        begin_time, end_time = feature.get_valid_time()
 
+        return bool(self._inWindow(np.float64(begin_time), np.float64(end_time)))
 
+    def _inWindow(self, begin_time, end_time):
 
-        # Filter by age of appearance
-        if filter_ == 3:
+        oldest, youngest = self.window
 
-            if ageAppearWindow[0] == "DP":
-                ageAppearWindow[0] = float("inf")
+        if self.mode == "appear":
+            return (begin_time <= oldest) & (begin_time >= youngest)
 
-            for feature in data_:
+        if self.mode == "disappear":
+            return (end_time <= oldest) & (end_time >= youngest)
 
-                begin_time, end_time = feature.get_valid_time()
+        return (((begin_time >= oldest) & (end_time <= youngest)) |
+                ((begin_time >= oldest) & (end_time <= oldest) & (end_time >= youngest)) |
+                ((begin_time <= oldest) & (end_time >= youngest)))
 
-                if begin_time <= ageAppearWindow[0] and begin_time >= ageAppearWindow[1]:
-                    f3_result.add(feature)
+    def describe(self):
 
-            print "    3. Filtering data by age of appearance window: " + str(ageAppearWindow[0]) + " - " + str(ageAppearWindow[1]) + " Ma"
-            print "       - Found " + str(len(f3_result)) + " feature(s)."
-            print " "
+        names = {"appear": "age of appearance", "disappear": "age of disappearance", "exists": "age of existence"}
 
-            previousFilter = 3
+        return ("Filtering data by " + names[self.mode] + " window: " + str(self.window[0]) + " - " +
+                str(self.window[1]) + " Ma")
 
 
+def _age(age):
 
-        # Filter by age of disappearance
-        if filter_ == 4:
+    if age == "DP":
+        return float("inf")
+    if age == "DF":
+        return float("-inf")
 
-            if ageDisappearWindow[1] == "DF":
-                    ageDisappearWindow[1] = float("-inf")
+    return float(age)
 
-            for feature in data_:
 
-                begin_time, end_time = feature.get_valid_time()
+# Geographic bounding box [lon 1, lon 2, lat 1, lat 2]. Selects features with any centre line vertex inside the box.
+class BBox(Predicate):
 
-                if end_time <= ageDisappearWindow[0] and end_time >= ageDisappearWindow[1]:
-                    f4_result.add(feature)
+    cost = 5.0
 
-            print "    4. Filtering data by age of disappearance window: " + str(ageDisappearWindow[0]) + " - " + str(ageDisappearWindow[1]) + " Ma"
-            print "       - Found " + str(len(f4_result)) + " feature(s)."
-            print " "
+    def __init__(self, boundingBox):
 
-            previousFilter = 4
+        self.boundingBox = [float(value) for value in boundingBox]
 
+    def evaluate(self, index, rows):
 
+        lats, lons, offsets = index.column("centre_line")
 
-        # Filter by geographic selection / polygon
-        if filter_ == 5:
+        # Gather the vertices of the requested rows only, then reduce per row
+        counts = offsets[rows + 1] - offsets[rows]
+        row = np.repeat(np.arange(len(rows)), counts)
+        vertex = np.repeat(offsets[rows], counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
 
-            for feature in data_:
-                for property in feature:
+        inside = self._inBox(lats[vertex], lons[vertex])
 
-                    filter_property = property.get_name()
+        return np.bincount(row, weights=inside, minlength=len(rows)) > 0
 
-                    if filter_property.get_name() == "centerLineOf":
-                        selected_filter_property = property.get_value()
+    def matches(self, feature):
 
-                        points = selected_filter_property.get_value().get_base_curve().get_polyline().get_points_view()
+        vertices = _centreLineVertices(feature)
 
-                        for point in points:
-                            point_latlong = pgp.convert_point_on_sphere_to_lat_lon_point(point)
+        return bool(np.any(self._inBox(vertices[:, 0], vertices[:, 1])))
 
-                            if point_latlong.get_longitude() >= float(boundingBox[0]) and point_latlong.get_longitude() <= float(boundingBox[1])\
-                                    and point_latlong.get_latitude() >= float(boundingBox[2]) and point_latlong.get_latitude() <= float(boundingBox[3]):
+    def _inBox(self, lats, lons):
 
-                                # If point is found within bounding box, add feature and break loop (search next feature)
-                                f5_result.add(feature)
-                                break
+        lon_1, lon_2, lat_1, lat_2 = self.boundingBox
 
-            print "    5. Filtering data by geographic bounding box: " + str(boundingBox[0]) + "/" + str(boundingBox[1]) + "/" + str(boundingBox[2]) + "/" + str(boundingBox[3])
-            print "       - Found " + str(len(f5_result)) + " feature(s)."
-            print " "
+        return (lons >= lon_1) & (lons <= lon_2) & (lats >= lat_1) & (lats <= lat_2)
 
-            previousFilter = 5
+    def describe(self):
 
+        return "Filtering data by geographic bounding box: " + "/".join(str(value) for value in self.boundingBox)
 
 
-        # Filter by age exists window
-        if filter_ == 6:
+# Feature type, as filterGPML codes ("ISO", "MOR", "PCB" or "ALL") or GPlates feature type names.
+class FeatureType(Predicate):
 
-            for feature in data_:
+    def __init__(self, featureTypes):
 
-                begin_time, end_time = feature.get_valid_time()
+        names = []
 
-                if begin_time >= ageExistsWindow[0] and end_time <= ageExistsWindow[1]:
-                    f6_result.add(feature)
-                elif begin_time >= ageExistsWindow[0] and end_time <= ageExistsWindow[0] and end_time >= ageExistsWindow[1]:
-                    f6_result.add(feature)
-                elif begin_time <= ageExistsWindow[0] and end_time >= ageExistsWindow[1]:
-                    f6_result.add(feature)
-                elif begin_time <= ageExistsWindow[0] and end_time >= ageExistsWindow[1] and end_time <= ageExistsWindow[1]:
-                    f6_result.add(feature)
+        for feature_type in featureTypes:
 
-            print "    6. Filtering data by age of existence window: " + str(ageExistsWindow[0]) + " - " + str(ageExistsWindow[1]) + " Ma"
-            print "       - Found " + str(len(f6_result)) + " feature(s)."
-            print " "
+            if feature_type == "ALL":
+                names.extend(FEATURE_TYPE_CODES[code] for code in ["ISO", "MOR", "PCB"])
+            else:
+                names.append(FEATURE_TYPE_CODES.get(feature_type, feature_type))
+
+        self.featureTypes = [name if name.startswith("gpml:") else "gpml:" + name for name in names]
+
+    def evaluate(self, index, rows):
+
+        return np.isin(index.column("feature_type")[rows], self.featureTypes)
+
+    def matches(self, feature):
+
+        return str(feature.get_feature_type()) in self.featureTypes
+
+    def describe(self):
 
-            previousFilter = 6
+        return "Filtering data by feature type(s): " + str([name[5:] for name in self.featureTypes])
 
 
+# Geometry type of the feature's geometry ("PolylineOnSphere", "PolygonOnSphere", "PointOnSphere",
+# "MultiPointOnSphere" or "ALL").
+class GeometryType(Predicate):
 
-        # Filter by feature type
-        if filter_ == 7:
+    def __init__(self, geometryTypes):
 
-            iso_count = 0
-            mor_count = 0
-            pcb_count = 0
+        self.geometryTypes = list(GEOMETRY_TYPES) if "ALL" in geometryTypes else list(geometryTypes)
 
-            for feature in data_:
+    def evaluate(self, index, rows):
 
-                if "Isochron" in featureType:
-                    if str(feature.get_feature_type()) == "gpml:Isochron":
-                        f7_result.add(feature)
-                        iso_count += 1
-                if "MidOceanRidge" in featureType:
-                    if str(feature.get_feature_type()) == "gpml:MidOceanRidge":
-                        f7_result.add(feature)
-                        mor_count += 1
-                if "PassiveContinentalBoundary" in featureType:
-                    if str(feature.get_feature_type()) == "gpml:PassiveContinentalBoundary":
-                        f7_result.add(feature)
-                        pcb_count += 1
+        return np.isin(index.column("geometry_type")[rows], self.geometryTypes)
 
+    def matches(self, feature):
 
-            print "    7. Filtering data by feature type(s): " + str(featureType)
+        return _geometryType(feature) in self.geometryTypes
 
-            if "Isochron" in featureType:
-                print "       - Found " + str(iso_count) + " Isochron(s)."
-            if "MidOceanRidge" in featureType:
-                print "       - Found " + str(mor_count) + " MidOceanRidge(s)."
-            if "PassiveContinentalBoundary" in featureType:
-                print "       - Found " + str(pcb_count) + " PassiveContinentalBoundary(s)."
+    def describe(self):
 
-            print " "
+        return "Filtering data by feature geometries present: " + str(self.geometryTypes)
 
-            previousFilter = 7
 
+# Feature ID (gpml:identity), case insensitive.
+class FeatureID(Predicate):
 
+    def __init__(self, featureIDs):
 
-        # Filter by geometry type
-        if filter_ == 8:
+        self.featureIDs = [str(feature_id).lower() for feature_id in featureIDs]
 
-            polylineCount = 0
-            polygonCount = 0
-            pointCount = 0
-            multiPointCount = 0
+    def evaluate(self, index, rows):
 
-            for feature in data_:
+        return np.isin(index.column("feature_id")[rows], self.featureIDs)
 
-                geometries = feature.get_geometry()
+    def matches(self, feature):
 
-                for geometry in geometryType:
+        return str(feature.get_feature_id()).lower() in self.featureIDs
 
-                    if str(geometry) in str(geometries):
-                        f8_result.add(feature)
+    def describe(self):
 
-                        if str(geometry) == "PolylineOnSphere":
-                            polylineCount += 1
-                        if str(geometry) == "PolygonOnSphere":
-                            polygonCount += 1
-                        if str(geometry) == "PointOnSphere":
-                            pointCount += 1
-                        if str(geometry) == "MultiPointOnSphere":
-                            multiPointCount += 1
+        return "Filtering data by feature ID: " + str(self.featureIDs)
 
-            print "    8. Filtering data by feature geometries present: " + str(geometryType)
 
-            if "PolylineOnSphere" in geometryType:
-                print "       - Found " + str(polylineCount) + " PolylineOnSphere(s)."
-            if "PolygonOnSphere" in geometryType:
-                print "       - Found " + str(polygonCount) + " PolygonOnSphere(s)."
-            if "PointOnSphere" in geometryType:
-                print "       - Found " + str(pointCount) + " PointOnSphere(s)."
-            if "MultiPointOnSphere" in geometryType:
-                print "       - Found " + str(multiPointCount) + " MultiPointOnSphere(s)."
+# Feature name containing any of the given strings, case insensitive.
+class Name(Predicate):
 
-            print " "
+    cost = 2.0
 
-            previousFilter = 8
+    def __init__(self, names):
 
+        self.names = [name.lower() for name in names]
 
+    def evaluate(self, index, rows):
 
-        # Filter by feature ID
-        if filter_ == 9:
+        feature_names = index.column("name")[rows]
+        found = np.zeros(len(rows), dtype=bool)
 
-            for feature in data_:
+        for name in self.names:
+            found |= np.char.find(feature_names, name) >= 0
 
-                for id in featureID:
+        return found
 
-                    if str(feature.get_feature_id()).lower() == str(id).lower():
-                    
-                        f9_result.add(feature)
+    def matches(self, feature):
 
-            print "    9. Filtering data by feature ID: " + str(featureID)
-            print "       - Found " + str(len(f9_result)) + " feature(s)."
-            print " "
+        feature_name = feature.get_name().lower()
 
-            previousFilter = 9
+        return any(name in feature_name for name in self.names)
 
+    def describe(self):
 
+        return "Filtering data by feature name: " + str(self.names)
 
-        # Filter by feature name (case insensitive)
-        if filter_ == 10:
 
-            for feature in data_:
+# Truncate features by an age boundary (Ma), splitting them into features older and younger than it. This is not a
+# selection and does not commute with the predicates, so it must be the last step of a filter sequence.
+class Truncate(object):
 
-                feature_name = feature.get_name()
+    def __init__(self, age):
 
-                for names in featureName:
+        self.age = age
 
-                    if names.lower() in feature_name.lower():
-                        f10_result.add(feature)
+    def split(self, features):
 
-            print "    10. Filtering data by feature name: " + str(featureName)
-            print "       - Found " + str(len(f10_result)) + " feature(s)."
-            print " "
+        age = self.age
+        older = pgp.FeatureCollection()
+        younger = pgp.FeatureCollection()
 
-            previousFilter = 10
+        # The younger half is built from copies (keeping the feature IDs that topologies refer to), as the older half
+        # changes the valid times of the features
+        for feature in features:
 
+            begin_time, end_time = feature.get_valid_time()
 
+            if begin_time > age and end_time <= age:
 
-        # Truncate file by age boundary
-        if filter_ == 11:
+                feature_copy = _copyFeature(feature)
 
-            for feature in data_:
+                # Subduction zones keep their start age in 'gpml:subductionZoneAge'
+                if str(feature.get_feature_type()) == "gpml:SubductionZone":
 
-                begin_time, end_time = feature.get_valid_time()
+                    if "gpml:subductionZoneAge" not in [str(property.get_name()) for property in feature_copy]:
+                        feature_copy.add(pgp.PropertyName.create_gpml('subductionZoneAge'), pgp.XsDouble(begin_time))
 
-                
-                if begin_time > feature_truncate_age and end_time > feature_truncate_age:
+                feature_copy.set_valid_time(age, end_time)
+                younger.add(feature_copy)
 
-                    f11a_result.add(feature)
+            elif begin_time == age or (begin_time <= age and end_time < age):
 
+                younger.add(feature)
 
-                elif begin_time > feature_truncate_age and end_time <= feature_truncate_age:
+        for feature in features:
 
-                    # Special case if SubductionZone - need to incorporate start age
-                    if str(feature.get_feature_type()) == "gpml:SubductionZone":
+            begin_time, end_time = feature.get_valid_time()
 
-                        feature.set_valid_time(begin_time, feature_truncate_age + 0.1)
-                        f11a_result.add(feature)
-                        
-                    else:
+            if begin_time > age and end_time > age:
 
-                        feature.set_valid_time(begin_time, feature_truncate_age + 0.1)
-                        f11a_result.add(feature)
+                older.add(feature)
 
+            elif begin_time > age and end_time <= age:
 
-            # Limitation of pyGPlates: need to loop through copy of feature
-            for feature in feature1:
+                feature.set_valid_time(begin_time, age + 0.1)
+                older.add(feature)
 
-                begin_time, end_time = feature.get_valid_time()
+        return older, younger
 
-        
-                if begin_time > feature_truncate_age and end_time <= feature_truncate_age:
+    def describe(self):
 
-                    # Special case if SubductionZone - need to incorporate start age
-                    if str(feature.get_feature_type()) == "gpml:SubductionZone":
+        return "File truncated by age boundary: " + str(self.age) + " Ma"
 
-                        #print feature.get_name()
-                        sz_age_array = []
 
-                        for property in feature:
+# Copy a feature under the same feature ID (Feature.clone() would give it a new one). Property values are cloned so
+# changing the valid time of either feature leaves the other alone.
+def _copyFeature(feature):
 
-                            # Create array or properties and add 'gpml:subductionZoneAge' if there isn't one already
-                            sz_age_array.append(str(property.get_name()))
+    feature_copy = pgp.Feature(feature.get_feature_type(), feature.get_feature_id())
 
-                        
-                        if "gpml:subductionZoneAge" not in sz_age_array:
-                                
-                            #print feature.get_name()
-                            feature.add(pgp.PropertyName.create_gpml('subductionZoneAge'), pgp.XsDouble(begin_time))
+    for property in feature:
+        feature_copy.add(property.get_name(), property.get_time_dependent_value().clone(),
+                         pgp.VerifyInformationModel.no)
 
+    return feature_copy
 
-                        feature.set_valid_time(feature_truncate_age, end_time)
 
-                        f11b_result.add(feature)
 
+#### Filter engine ####
 
-                    else:
+# Order a filter sequence for evaluation. All predicates commute (the result is their intersection), so they are
+# sorted to run the cheapest, most selective first: selectivity is estimated with the scalar test on an evenly spaced
+# sample of at most sampleSize features. A Truncate step stays last.
+def planFilters(steps, features, sampleSize=256):
 
-                        feature.set_valid_time(feature_truncate_age, end_time)
-                        f11b_result.add(feature)
+    steps = list(steps)
+    truncate = [step for step in steps if isinstance(step, Truncate)]
+    predicates = [step for step in steps if not isinstance(step, Truncate)]
 
+    if len(truncate) > 1 or (truncate and steps[-1] is not truncate[0]):
+        raise ValueError("Truncate must be the last step of a filter sequence")
 
-                elif begin_time == feature_truncate_age:
+    features = list(features)
+    sample = features[::max(1, len(features) // sampleSize)][:sampleSize]
 
-                    f11b_result.add(feature)
+    def rank(predicate):
 
+        passed = sum(1 for feature in sample if predicate.matches(feature))
+        rejected = 1. - (passed + 1.) / (len(sample) + 2.)
 
-                elif begin_time <= feature_truncate_age and end_time < feature_truncate_age:
+        return predicate.cost / max(rejected, 1e-6)
 
-                    f11b_result.add(feature)
+    return sorted(predicates, key=rank) + truncate
 
-                
-            print "    11. File truncated by age boundary: " + str(feature_truncate_age) + " Ma"
-            print "       - Created " + str(len(f11a_result)) + " feature(s) older than truncation boundary."
-            print "       - Created " + str(len(f11b_result)) + " feature(s) younger than truncation boundary."
-            print " "
 
-            previousFilter = 11
+# Apply a filter sequence (predicates, optionally ending with Truncate) to features. Each predicate is evaluated
+# only on the features that passed the previous ones, vectorised over a FeatureIndex or, with vectorised=False, one
+# feature at a time. If log is a list, (step, number of features found) is appended to it for every step.
+# Returns the selected features in their original order as a FeatureCollection, or (older, younger) collections if
+# the sequence ends with Truncate
+def applyFilters(features, steps, plan=True, vectorised=True, log=None):
 
+    features = list(features)
+    steps = planFilters(steps, features) if plan else list(steps)
 
+    if any(isinstance(step, Truncate) for step in steps[:-1]):
+        raise ValueError("Truncate must be the last step of a filter sequence")
 
+    index = FeatureIndex(features)
+    rows = np.arange(len(features))
+
+    for step in steps:
+
+        if isinstance(step, Truncate):
+
+            result = step.split([features[row] for row in rows])
+
+            if log is not None:
+                log.append((step, len(result[0]) + len(result[1])))
+
+            return result
+
+        if vectorised:
+            keep = step.evaluate(index, rows)
+        else:
+            keep = np.array([step.matches(features[row]) for row in rows], dtype=bool)
+
+        rows = rows[keep]
+
+        if log is not None:
+            log.append((step, len(rows)))
+
+    return pgp.FeatureCollection([features[row] for row in rows])
+
+
+# Filter codes of filterGPML and the argument each one reads
+FILTER_ARGUMENTS = {1: "rPlateID", 2: "cPlateID", 3: "ageAppearWindow", 4: "ageDisappearWindow", 5: "boundingBox",
+                    6: "ageExistsWindow", 7: "featureType", 8: "geometryType", 9: "featureID", 10: "featureName",
+                    11: "feature_truncate_age"}
+
+
+
+# Filter GPML by selected criteria and output new GPML file of filtered data
+def filterGPML(**kwargs):
+
+    # Start the clock
+    start = time.time()
+
+    filterProperties = ["inputFile", "outputFile", "filterSequence", "rPlateID", "cPlateID", "ageAppearWindow", "ageDisappearWindow",
+                        "ageExistsWindow", "boundingBox", "featureType", "geometryType", "featureID", "featureName", "feature_truncate_age", "inverse", "cascade",
+                        "metrics", "densifySpacing"]
+
+    # Inverse is False, cascade is True and polyline metrics are not calculated by default
+    arguments = {"inverse": False, "cascade": True, "metrics": False, "densifySpacing": None, "filterSequence": []}
+
+    for parameter, value in kwargs.items():
+
+        if parameter in filterProperties:
+            arguments[parameter] = value
+        else:
+            print(" ")
+            print("ERROR - Filter criteria not found: " + str(parameter))
+            print(" ")
+
+    _checkArguments(arguments)
+
+    inputFile = arguments.get("inputFile")
+    outputFile = arguments.get("outputFile")
+
+    featureCollection = pgp.FeatureCollectionFileFormatRegistry()
+
+    print(" ")
+    print("--------------------------------------------")
+    print(" ### GPMLTools - filterGPML ###")
+
+    # Check for existing output directory and create it if not found
+    if not os.path.exists("output"):
+        os.makedirs("output")
+        print(" ")
+        print("Housekeeping:")
+        print("    No output folder found. Folder 'output' created.")
+
+    # Check for existing output file with same name and remove if found
+    if os.path.isfile("output/output.gpml"):
+        os.remove("output/output.gpml")
+        print(" ")
+        print("Housekeeping:")
+        print("    Previous 'output.gpml' found in destination folder. File removed for new filter sequence.")
+
+    try:
+        feature = featureCollection.read(inputFile)
+        print(" ")
+        print("Data handling:")
+        print("    Successfully loaded data file:  '" + str(inputFile) + "'")
+        print("       - File contains " + str(len(feature)) + " features.")
+
+    except pgp.OpenFileForReadingError:
+        print(" ")
+        print("    ERROR - File read error in: '" + str(inputFile) + "'. Is this a valid GPlates file?")
+        return
+
+    except pgp.FileFormatNotSupportedError:
+        print(" ")
+        print("    ERROR - File format not supported: '" + str(inputFile) + "'. Please check the file name and try again")
+        return
+
+    # Filter data
+    steps, codes = _filterSteps(arguments)
+    log = []
+
+    result = applyFilters(feature, steps, log=log)
+
+    print(" ")
+    print("Filter sequence:")
+
+    for step, count in log:
+
+        print("    " + str(codes[id(step)]) + ". " + step.describe())
+
+        if isinstance(step, Truncate):
+            print("       - Created " + str(len(result[0])) + " feature(s) older than truncation boundary.")
+            print("       - Created " + str(len(result[1])) + " feature(s) younger than truncation boundary.")
+        else:
+            print("       - Found " + str(count) + " feature(s).")
+
+        print(" ")
 
     # output new feature collection from filtered data to file
+    if isinstance(result, tuple):
 
-    if previousFilter == 11:
+        feature_truncate_age = arguments["feature_truncate_age"]
 
-        iso_output1 = eval("f" + str(previousFilter) + "a_result")
-        iso_output2 = eval("f" + str(previousFilter) + "b_result")
+        for number, (prefix, iso_output) in enumerate(zip([">", "<"], result)):
 
-        if len(iso_output1) != 0:
-            
-            outputFeatureCollection1 = pgp.FeatureCollectionFileFormatRegistry()
-            outputFeatureCollection1.write(iso_output1, "output/>" + str(feature_truncate_age) + "Ma_" + str(outputFile))
+            if len(iso_output) != 0:
 
-            print " "
-            print "Output file 1:"
-            print "    ../output/" + ">" + str(feature_truncate_age) + "Ma_"+ str(outputFile)
-            print " "
-            print "Process took " + str(round(time.time() - start, 2)) + " seconds."
-            print " "
+                outputName = "output/" + prefix + str(feature_truncate_age) + "Ma_" + str(outputFile)
+                pgp.FeatureCollectionFileFormatRegistry().write(iso_output, outputName)
 
-        if len(iso_output2) != 0:
-            
-            outputFeatureCollection2 = pgp.FeatureCollectionFileFormatRegistry()
-            outputFeatureCollection2.write(iso_output2, "output/<" + str(feature_truncate_age) + "Ma_" + str(outputFile))
+                print("Output file " + str(number + 1) + ":")
+                print("    ../" + outputName)
+                print(" ")
+                print("Process took " + str(round(time.time() - start, 2)) + " seconds.")
+                print(" ")
 
-            print "Output file 2:"
-            print "    ../output/" + "<" + str(feature_truncate_age) + "Ma_"+ str(outputFile)
-            print " "
-            print "Process took " + str(round(time.time() - start, 2)) + " seconds."
-            print "--------------------------------------------"
+        print("--------------------------------------------")
 
+        if arguments["metrics"] == True:
+            return tuple(calculateMetrics(iso_output, arguments["densifySpacing"]) for iso_output in result)
 
     else:
 
-        iso_output = eval("f" + str(previousFilter) + "_result")
+        pgp.FeatureCollectionFileFormatRegistry().write(result, outputFile)
+
+        print("Output file:")
+        print(str(outputFile))
+        print(" ")
+        print("Process took " + str(round(time.time() - start, 2)) + " seconds.")
+        print("--------------------------------------------")
+
+        if arguments["metrics"] == True:
+            return calculateMetrics(result, arguments["densifySpacing"])
+
+
+def _checkArguments(arguments):
 
-        outputFeatureCollection = pgp.FeatureCollectionFileFormatRegistry()
-        outputFeatureCollection.write(iso_output, outputFile)
+    ageExistsWindow = arguments.get("ageExistsWindow")
 
-        print "Output file:"
-        print str(outputFile)
-        print " "
-        print "Process took " + str(round(time.time() - start, 2)) + " seconds."
-        print "--------------------------------------------"
+    if ageExistsWindow is not None and ageExistsWindow[1] > ageExistsWindow[0]:
+        print(" ")
+        print("ERROR - Age exists window end age older than begin age: " + str(ageExistsWindow[1]))
+
+    boundingBox = arguments.get("boundingBox")
+
+    if boundingBox is not None:
+
+        for value in boundingBox[:2]:
+            if pgp.LatLonPoint.is_valid_longitude(value) is False:
+                print(" ")
+                print("ERROR - Bounding box longitude is not valid: " + str(value))
+
+        for value in boundingBox[2:]:
+            if pgp.LatLonPoint.is_valid_latitude(value) is False:
+                print(" ")
+                print("ERROR - Bounding box latitude is not valid: " + str(value))
+
+
+# Translate filterGPML's numbered filter sequence into filter steps, with the filter code of each step for reporting
+def _filterSteps(arguments):
+
+    steps = []
+    codes = {}
+    cascade = arguments["cascade"]
+    inverse = arguments["inverse"]
+
+    for code in arguments["filterSequence"]:
+
+        if code not in FILTER_ARGUMENTS:
+            print(" ")
+            print("ERROR - Filter not found: " + str(code))
+            continue
+
+        value = arguments.get(FILTER_ARGUMENTS[code])
+
+        if code == 1 and cascade == False:
+
+            # Secret command: match reconstruction and conjugate plate IDs together (once only)
+            if inverse == False:
+                step = PlateID(value[:1], arguments["cPlateID"][:1])
+            else:
+                step = PlateID(value, arguments["cPlateID"], inverse=True)
+
+            cascade = True
+
+        elif code == 1:
+            step = PlateID(value, inverse=inverse)
+        elif code == 2:
+            step = PlateID(conjugatePlateIDs=value, inverse=inverse)
+        elif code == 3:
+            step = AgeWindow(value, "appear")
+        elif code == 4:
+            step = AgeWindow(value, "disappear")
+        elif code == 5:
+            step = BBox(value)
+        elif code == 6:
+            step = AgeWindow(value, "exists")
+        elif code == 7:
+            step = FeatureType(value)
+        elif code == 8:
+            step = GeometryType(value)
+        elif code == 9:
+            step = FeatureID(value)
+        elif code == 10:
+            step = Name(value)
+        elif code == 11:
+            step = Truncate(value)
+
+        steps.append(step)
+        codes[id(step)] = code
+
+    return steps, codes
+
+
+
+# Calculate per-feature polyline metrics (length, vertex count, bearing and optionally densified geometry) of filtered
+# data as a table of columns. Uses geoTools, which must be on the PYTHONPATH.
+def calculateMetrics(features, densifySpacing=None):
+
+    import geoTools
+
+    return geoTools.featureMetrics(features, spacing=densifySpacing)
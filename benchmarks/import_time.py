@@ -0,0 +1,62 @@
+"""
+    import_time
+
+    Benchmark the time taken to import geoTools in a fresh interpreter and check that none of the heavy plotting or
+    GPlates libraries are pulled in at import time. Exits non-zero if any are, or if the median import time exceeds
+    the given limit, so it can be used as a check in batch / CI environments.
+
+    Usage:  python benchmarks/import_time.py [repeats] [limit_seconds]
+"""
+
+import os
+import subprocess
+import sys
+
+
+HEAVY_MODULES = ["pygplates", "ipmag", "matplotlib", "pylab", "mpl_toolkits.basemap"]
+
+SNIPPET = """
+import sys, time
+start = time.time()
+import geoTools
+elapsed = time.time() - start
+print(elapsed)
+print(",".join(name for name in %r if name in sys.modules))
+""" % HEAVY_MODULES
+
+
+def measure(repeats=10):
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    times = []
+    loaded = set()
+
+    for i in range(repeats):
+
+        output = subprocess.check_output([sys.executable, "-c", SNIPPET], cwd=root, universal_newlines=True)
+        elapsed, modules = output.splitlines()[-2:]
+
+        times.append(float(elapsed))
+        loaded.update(name for name in modules.split(",") if name)
+
+    times.sort()
+
+    return times[len(times) // 2], sorted(loaded)
+
+
+if __name__ == "__main__":
+
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    limit = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+
+    median, loaded = measure(repeats)
+
+    print("import geoTools: median " + str(round(median * 1000, 1)) + " ms over " + str(repeats) + " runs")
+
+    if loaded:
+        print("ERROR - Heavy modules imported eagerly: " + ", ".join(loaded))
+
+    if median > limit:
+        print("ERROR - Import time exceeds limit of " + str(limit) + " s")
+
+    sys.exit(1 if loaded or median > limit else 0)
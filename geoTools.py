@@ -25,13 +25,56 @@
 """
 
 # Import required libraries
+import importlib
+import itertools
+import multiprocessing
+import warnings
+
 import numpy as np
-import pygplates as pgp
-import ipmag
-import matplotlib.pyplot as plt
-import pylab
 
-from mpl_toolkits.basemap import Basemap
+
+# Plotting and GPlates libraries are heavy (and Basemap is often missing on headless machines), so they are only
+# imported the first time they are used. The geoscience and palaeomagnetic functions need NumPy alone.
+class _LazyImport(object):
+
+    def __init__(self, module, attribute=None):
+
+        self._module = module
+        self._attribute = attribute
+        self._target = None
+
+    def _load(self):
+
+        if self._target is None:
+
+            target = importlib.import_module(self._module)
+
+            if self._attribute is not None:
+                target = getattr(target, self._attribute)
+
+            self._target = target
+
+        return self._target
+
+    def __getattr__(self, name):
+
+        return getattr(self._load(), name)
+
+    def __call__(self, *args, **kwargs):
+
+        return self._load()(*args, **kwargs)
+
+
+pgp = _LazyImport("pygplates")
+ipmag = _LazyImport("ipmag")
+plt = _LazyImport("matplotlib.pyplot")
+pylab = _LazyImport("pylab")
+
+mpl_agg = _LazyImport("matplotlib.backends.backend_agg")
+mpl_colors = _LazyImport("matplotlib.colors")
+mpl_figure = _LazyImport("matplotlib.figure")
+
+Basemap = _LazyImport("mpl_toolkits.basemap", "Basemap")
 
 
 """ GEOSCIENCE """
@@ -62,6 +105,176 @@ def haversine(lon1, lat1, lon2, lat2):
     return km, np.rad2deg(c), bearing
 
 
+"""
+    polylineMetrics
+
+    Batched great circle metrics for many polylines at once. Vertices of all polylines are given as flat lat / lon
+    arrays (degrees) with offsets marking where each polyline starts (polyline i is vertices offsets[i] to
+    offsets[i + 1], so len(offsets) = number of polylines + 1). Reductions are segmented, with no loop over polylines.
+    Returns dictionary of arrays: segment_km, segment_bearing, segment_offsets, length_km, bearing (first to last
+    vertex) and n_vertices
+"""
+def polylineMetrics(lats, lons, offsets):
+
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+
+    n_vertices = np.diff(offsets)
+    n_segments = np.maximum(n_vertices - 1, 0)
+    segment_offsets = np.concatenate(([0], np.cumsum(n_segments)))
+
+    # Segments between consecutive vertices, less those that join the end of one polyline to the next
+    within = np.ones(max(len(lats) - 1, 0), dtype=bool)
+    within[offsets[1:-1][(offsets[1:-1] > 0) & (offsets[1:-1] < len(lats))] - 1] = False
+    start = np.nonzero(within)[0]
+
+    segment_km, _, segment_bearing = haversine(lons[start], lats[start], lons[start + 1], lats[start + 1])
+
+    polyline_index = np.repeat(np.arange(len(n_vertices)), n_segments)
+    length_km = np.bincount(polyline_index, weights=segment_km, minlength=len(n_vertices))
+
+    first = np.minimum(offsets[:-1], max(len(lats) - 1, 0))
+    last = np.maximum(offsets[1:] - 1, 0)
+    bearing = np.full(len(n_vertices), np.nan)
+    has_segment = n_segments > 0
+
+    if has_segment.any():
+        bearing[has_segment] = haversine(lons[first[has_segment]], lats[first[has_segment]],
+                                         lons[last[has_segment]], lats[last[has_segment]])[2]
+
+    return {"segment_km": segment_km, "segment_bearing": segment_bearing, "segment_offsets": segment_offsets,
+            "length_km": length_km, "bearing": bearing, "n_vertices": n_vertices}
+
+
+"""
+    densifyPolylines
+
+    Densify many polylines (flat lat / lon arrays with offsets, as for polylineMetrics) so that no segment is longer
+    than spacing kilometres. New vertices are spherically interpolated (slerp) along each great circle segment and
+    original vertices are kept. Raises ValueError unless spacing > 0.
+    Returns latitudes, longitudes and offsets of the densified polylines
+"""
+def densifyPolylines(lats, lons, offsets, spacing):
+
+    if not spacing > 0:
+        raise ValueError("densifyPolylines needs spacing > 0 km: " + str(spacing))
+
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+
+    x, y, z = _latLonToXYZ(lats, lons)
+
+    # Each vertex contributes itself if it starts a polyline, else the points along the segment ending at it
+    starts = np.zeros(len(lats), dtype=bool)
+    starts[offsets[:-1][offsets[:-1] < offsets[1:]]] = True
+
+    previous = np.where(starts, np.arange(len(lats)), np.arange(len(lats)) - 1)
+    segment_km = haversine(lons[previous], lats[previous], lons, lats)[0]
+    counts = np.where(starts, 1, np.maximum(np.ceil(segment_km / spacing), 1)).astype(np.int64)
+
+    vertex = np.repeat(np.arange(len(lats)), counts)
+    step = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+    t = step / counts[vertex].astype(np.float64)
+
+    a = previous[vertex]
+    b = vertex
+    cos_angle = np.clip(x[a] * x[b] + y[a] * y[b] + z[a] * z[b], -1., 1.)
+    angle = np.arccos(cos_angle)
+    sin_angle = np.sin(angle)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        wa = np.where(sin_angle > 1e-12, np.sin((1. - t) * angle) / sin_angle, 1. - t)
+        wb = np.where(sin_angle > 1e-12, np.sin(t * angle) / sin_angle, t)
+
+    new_lats, new_lons = _xyzToLatLon(wa * x[a] + wb * x[b], wa * y[a] + wb * y[b], wa * z[a] + wb * z[b])
+    new_offsets = np.concatenate(([0], np.cumsum(counts)))[offsets]
+
+    return new_lats, new_lons, new_offsets
+
+
+"""
+    flattenPolylines
+
+    Flatten the PolylineOnSphere geometries of pygplates features (e.g. filterGPML output) into the flat vertex arrays
+    used by polylineMetrics and densifyPolylines.
+    Returns latitudes, longitudes, offsets and the index of the feature each polyline belongs to
+"""
+def flattenPolylines(features):
+
+    vertices = []
+    feature_index = []
+
+    for i, feature in enumerate(features):
+
+        for geometry in feature.get_all_geometries():
+
+            if isinstance(geometry, pgp.PolylineOnSphere):
+                vertices.append(geometry.to_lat_lon_array())
+                feature_index.append(i)
+
+    lengths = [len(polyline) for polyline in vertices]
+    offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+
+    if not vertices:
+        return np.empty(0), np.empty(0), offsets, np.empty(0, dtype=np.int64)
+
+    vertices = np.concatenate(vertices)
+
+    return vertices[:, 0], vertices[:, 1], offsets, np.array(feature_index, dtype=np.int64)
+
+
+"""
+    featureMetrics
+
+    Per-feature polyline metrics of pygplates features (e.g. isochrons or ridges from filterGPML) as a table of
+    columns: feature_id, name, plate_id, n_polylines, n_vertices, length_km and bearing (first to last vertex of the
+    feature). If spacing (km) is given the densified geometry of each feature is added as densified_lats /
+    densified_lons (one array per feature) with its vertex count in densified_vertices.
+    Returns dictionary of columns, one row per feature
+"""
+def featureMetrics(features, spacing=None):
+
+    features = list(features)
+    lats, lons, offsets, feature_index = flattenPolylines(features)
+    metrics = polylineMetrics(lats, lons, offsets)
+    n_features = len(features)
+
+    table = {
+        "feature_id": [str(feature.get_feature_id()) for feature in features],
+        "name": [feature.get_name() for feature in features],
+        "plate_id": np.array([feature.get_reconstruction_plate_id() for feature in features], dtype=np.int64),
+        "n_polylines": np.bincount(feature_index, minlength=n_features),
+        "n_vertices": np.bincount(feature_index, weights=metrics["n_vertices"], minlength=n_features).astype(np.int64),
+        "length_km": np.bincount(feature_index, weights=metrics["length_km"], minlength=n_features),
+    }
+
+    # Overall strike from the first vertex of the first polyline to the last vertex of the last one
+    bearing = np.full(n_features, np.nan)
+    has_polyline = table["n_vertices"] > 1
+
+    if has_polyline.any():
+
+        first = offsets[:-1][np.searchsorted(feature_index, np.arange(n_features), side="left")[has_polyline]]
+        last = offsets[1:][np.searchsorted(feature_index, np.arange(n_features), side="right")[has_polyline] - 1] - 1
+        bearing[has_polyline] = haversine(lons[first], lats[first], lons[last], lats[last])[2]
+
+    table["bearing"] = bearing
+
+    if spacing is not None:
+
+        dense_lats, dense_lons, dense_offsets = densifyPolylines(lats, lons, offsets, spacing)
+
+        # Regroup densified polylines by feature
+        feature_offsets = dense_offsets[np.searchsorted(feature_index, np.arange(n_features + 1), side="left")]
+        table["densified_lats"] = np.split(dense_lats, feature_offsets[1:-1])
+        table["densified_lons"] = np.split(dense_lons, feature_offsets[1:-1])
+        table["densified_vertices"] = np.diff(feature_offsets)
+
+    return table
+
+
 """
     global_points_rand
 
@@ -70,35 +283,27 @@ def haversine(lon1, lat1, lon2, lat2):
 """
 def global_points_rand(samples):
 
-    lats = []
-    lons = []
-
-    for i in xrange(0, samples):
-
-        theta = 2 * np.pi * np.random.random()
-        phi = np.arccos(2 * np.random.random() - 1.0)
+    theta = 2 * np.pi * np.random.random(samples)
+    phi = np.arccos(2 * np.random.random(samples) - 1.0)
 
-        x = np.cos(theta) * np.sin(phi)
-        y = np.sin(theta) * np.sin(phi)
-        z = np.cos(phi)
+    x = np.cos(theta) * np.sin(phi)
+    y = np.sin(theta) * np.sin(phi)
+    z = np.cos(phi)
 
-        point = pgp.convert_point_on_sphere_to_lat_lon_point((x,y,z))
-        lats.append(point.get_latitude())
-        lons.append(point.get_longitude())
+    lats, lons = _xyzToLatLon(x, y, z)
 
-    return lats, lons
+    return lats.tolist(), lons.tolist()
 
 
 """
     global_points_uniform
 
-    Module to generate a uniform (even) distribution of lat / lon points on the Earth
+    Module to generate a uniform (even) distribution of lat / lon points on the Earth. If plotFile is given with
+    plotResult the points are rendered headless to that file as a density raster (see plotPointDensity) instead of
+    being drawn point by point on screen.
     Returns length = samples list of latitudes and longitudes
 """
-def global_points_uniform(samples, plotResult=False, projection='robin'):
-
-    lats = []
-    lons = []
+def global_points_uniform(samples, plotResult=False, projection='robin', plotFile=None):
 
     angle = np.pi * (3 - np.sqrt(5))
     theta = angle * np.arange(samples)
@@ -110,13 +315,17 @@ def global_points_uniform(samples, plotResult=False, projection='robin'):
     points[:,1] = radius * np.sin(theta)
     points[:,2] = z
 
-    for i in xrange(0, len(points)):
+    lats, lons = _xyzToLatLon(points[:,0], points[:,1], points[:,2])
+
+    if plotResult == True and plotFile is not None:
+
+        plotPointDensity(lats, lons, plotFile, projection=projection,
+                         title="n = " + str(samples) + " uniformly distributed global 'seed' locations")
 
-        point = pgp.convert_point_on_sphere_to_lat_lon_point((points[i][0], points[i][1], points[i][2]))
-        lats.append(point.get_latitude())
-        lons.append(point.get_longitude())
+    lats = lats.tolist()
+    lons = lons.tolist()
 
-    if plotResult == True:
+    if plotResult == True and plotFile is None:
 
         # Plot start seeds
         m = Basemap(projection=projection,lat_0=0,lon_0=0,resolution='c',area_thresh=50000)
@@ -136,73 +345,1279 @@ def global_points_uniform(samples, plotResult=False, projection='robin'):
 
 
 """
-    checkLatLon
+    plotPointDensity
 
-    Simple function to check incoming lat and lon are within correct ranges.
+    Render a (very) large global point distribution straight to an image file. Points are projected in chunks and
+    binned into a density raster on the map projection, drawn over a background (continents, coastlines and
+    graticule) that is rendered once per projection and size and then cached. Drawing uses the non-interactive Agg
+    canvas, so it runs on headless machines and never blocks; 10M+ points take seconds rather than minutes.
 """
-def checkLatLon(lat, lon):
+def plotPointDensity(lats, lons, filename, projection='robin', bins=(720, 360), figsize=(10, 6), dpi=150, title=None,
+                     cmap='viridis', logScale=True, chunk_size=2**22):
+
+    m = _cachedBasemap(projection)
+    extent = (m.xmin, m.xmax, m.ymin, m.ymax)
+
+    lats = np.asarray(lats, dtype=np.float64).ravel()
+    lons = np.asarray(lons, dtype=np.float64).ravel()
+    density = np.zeros((bins[1], bins[0]))
+
+    for start in range(0, len(lats), chunk_size):
+
+        x, y = m(lons[start:start + chunk_size], lats[start:start + chunk_size])
+        counts, _, _ = np.histogram2d(y, x, bins=(bins[1], bins[0]), range=[extent[2:], extent[:2]])
+        density += counts
+
+    fig = mpl_figure.Figure(figsize=figsize)
+    canvas = mpl_agg.FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+
+    ax.imshow(_cachedBackground(projection, figsize[0], dpi), extent=extent, origin='upper', interpolation='bilinear')
+
+    norm = mpl_colors.LogNorm() if logScale and density.any() else None
+    image = ax.imshow(np.ma.masked_equal(density, 0), extent=extent, origin='lower', cmap=cmap, norm=norm,
+                      interpolation='nearest', zorder=2)
+
+    ax.set_xlim(extent[0], extent[1])
+    ax.set_ylim(extent[2], extent[3])
+    ax.set_axis_off()
+
+    if title is not None:
+        ax.set_title(title)
+
+    fig.colorbar(image, ax=ax, orientation='horizontal', shrink=0.6, pad=0.05, label='points per cell')
+    canvas.print_figure(filename, dpi=dpi)
 
-    if lon > 180:
+    return filename
 
-        lon_corrected = -360 + lon
 
-    elif lon < -180:
+_basemap_cache = {}
+_background_cache = {}
 
-        lon_corrected = lon + 360
 
-    elif lon >= -180 and lon <= 180:
+def _cachedBasemap(projection, resolution='c'):
 
-        lon_corrected = lon
+    # Building a Basemap reads and projects the coastline database, so keep one per projection
+    key = (projection, resolution)
 
-    if lat > 90:
+    if key not in _basemap_cache:
+        _basemap_cache[key] = Basemap(projection=projection, lat_0=0, lon_0=0, resolution=resolution, area_thresh=50000)
 
-        lat_corrected = -180 + lat
+    return _basemap_cache[key]
 
-    elif lat < -90:
 
-        lat_corrected = lat + 180
+def _cachedBackground(projection, width, dpi):
 
-    elif lat >= -90 and lat <= 90:
+    key = (projection, width, dpi)
 
-        lat_corrected = lat
+    if key in _background_cache:
+        return _background_cache[key]
 
-    return lat_corrected, lon_corrected
+    m = _cachedBasemap(projection)
+    height = width * (m.ymax - m.ymin) / (m.xmax - m.xmin)
 
+    fig = mpl_figure.Figure(figsize=(width, height), dpi=dpi)
+    canvas = mpl_agg.FigureCanvasAgg(fig)
+    ax = fig.add_axes([0, 0, 1, 1])
 
+    m.fillcontinents(color='bisque', zorder=1, ax=ax)
+    m.drawcoastlines(linewidth=0.25, ax=ax)
+    m.drawmeridians(np.arange(0, 360, 30), ax=ax)
+    m.drawparallels(np.arange(-90, 90, 30), ax=ax)
+
+    ax.set_xlim(m.xmin, m.xmax)
+    ax.set_ylim(m.ymin, m.ymax)
+    ax.set_aspect('auto')
+    ax.set_axis_off()
+
+    canvas.draw()
+    _background_cache[key] = np.asarray(canvas.buffer_rgba()).copy()
+
+    return _background_cache[key]
+
+
+"""
+    region_points_rand
+
+    Module to generate a random distribution of exactly samples lat / lon points inside a region, sampled directly
+    rather than by discarding global points. The region is either a filterGPML style boundingBox
+    [lon 1, lon 2, lat 1, lat 2], sampled by inverse-CDF (uniform in longitude and in sine of latitude), or polygons
+    (anything accepted by buildPolygonIndex, or an index from it), sampled by picking polygon bounding caps in
+    proportion to their area and rejecting points outside the polygon with batched containment tests (where
+    polygons overlap only the first one, as in partitionPoints, keeps the point). Raises
+    ValueError if the polygons enclose no area to sample.
+    Returns arrays of latitudes and longitudes
 """
+def region_points_rand(samples, boundingBox=None, polygons=None, seed=None):
+
+    rng = np.random.default_rng(seed)
+
+    if (boundingBox is None) == (polygons is None):
+        raise ValueError("region_points_rand needs exactly one of boundingBox or polygons")
+
+    if boundingBox is not None:
+
+        lon_min, lon_width, sin_min, sin_max = _boxExtent(boundingBox)
+
+        lats = np.degrees(np.arcsin(rng.uniform(sin_min, sin_max, samples)))
+        lons = lon_min + lon_width * rng.random(samples)
+
+        return _normaliseLatLon(lats, lons)
+
+    index = polygons if _isPolygonIndex(polygons) else buildPolygonIndex(polygons)
+
+    if len(index["plate_id"]) == 0:
+        raise ValueError("region_points_rand found no polygons to sample")
+
+    if samples == 0:
+        return np.empty(0), np.empty(0)
+
+    cap_area = 1. - index["cos_radius"]
+
+    if not cap_area.sum() > 0:
+        raise ValueError("region_points_rand found no polygon area to sample")
+
+    weights = cap_area / cap_area.sum()
+
+    lats = []
+    lons = []
+    found = 0
+    acceptance = 0.5
+    empty_batches = 0
+
+    while found < samples:
+
+        # Polygons with zero area never accept a point
+        if empty_batches == _MAX_EMPTY_BATCHES:
+            raise ValueError("region_points_rand found no points inside the polygons, do they enclose any area?")
+
+        batch = int(min(max((samples - found) / acceptance * 1.1, 1024), 2**22))
+        choice = rng.choice(len(cap_area), size=batch, p=weights)
+        x, y, z = _capPoints(index, choice, rng)
+
+        batch_lats, batch_lons = _xyzToLatLon(x, y, z)
+
+        # Only the first polygon containing a point accepts it, so overlaps are not sampled twice
+        accepted = _firstPolygon(index, batch_lats, batch_lons) == choice
+
+        empty_batches = 0 if accepted.any() else empty_batches + 1
+        acceptance = max(accepted.mean(), 1e-3)
+
+        lats.append(batch_lats[accepted])
+        lons.append(batch_lons[accepted])
+        found += np.count_nonzero(accepted)
+
+    return np.concatenate(lats)[:samples], np.concatenate(lons)[:samples]
 
-    featureScaling
 
-    Normalise dataset using feature scaling
 """
-def featureScaling(data):
+    region_points_uniform
+
+    Module to generate a uniform (even) distribution of exactly samples lat / lon points inside a region, using
+    golden ratio lattices in equal-area coordinates. The region is either a filterGPML style boundingBox
+    [lon 1, lon 2, lat 1, lat 2], covered by a lattice in (longitude, sine of latitude), or polygons (anything
+    accepted by buildPolygonIndex, or an index from it). For polygons each bounding cap gets a spiral lattice, all at
+    the same density, points are kept by the first polygon containing them (as in partitionPoints) and any surplus
+    is thinned evenly along the lattices. Raises ValueError if the polygons enclose no area to sample, or would need
+    more than _MAX_LATTICE_POINTS lattice points.
+    Returns arrays of latitudes and longitudes
+"""
+def region_points_uniform(samples, boundingBox=None, polygons=None):
 
-    norm_data = []
-    min_data = np.nanmin(data)
-    max_data = np.nanmax(data)
+    if (boundingBox is None) == (polygons is None):
+        raise ValueError("region_points_uniform needs exactly one of boundingBox or polygons")
 
-    for i in xrange(0, len(data)):
+    if boundingBox is not None:
+        return _normaliseLatLon(*_latticePoints(samples, *_boxExtent(boundingBox)))
 
-        norm_data.append( (data[i] - min_data) / (max_data - min_data) )
+    index = polygons if _isPolygonIndex(polygons) else buildPolygonIndex(polygons)
 
-    return np.array(norm_data)
+    if len(index["plate_id"]) == 0:
+        raise ValueError("region_points_uniform found no polygons to sample")
 
+    if samples == 0:
+        return np.empty(0), np.empty(0)
 
+    if not (1. - index["cos_radius"]).sum() > 0:
+        raise ValueError("region_points_uniform found no polygon area to sample")
+
+    # Fraction of the cap lattices inside the polygons, guessed first and then measured
+    acceptance = 0.5
+    count = 0
+
+    for refinement in range(_MAX_LATTICE_REFINEMENTS):
+
+        total = int(np.ceil(samples / acceptance * 1.05)) + 1
+
+        # Polygons that a lattice this size misses entirely have no area (slivers or repeated vertices)
+        if refinement and count == 0 and total > _MAX_EMPTY_LATTICE_POINTS:
+            break
+
+        if total > _MAX_LATTICE_POINTS:
+            raise ValueError("region_points_uniform needs more than _MAX_LATTICE_POINTS (" + str(_MAX_LATTICE_POINTS) +
+                             ") lattice points to place " + str(samples) + " samples in these polygons")
+
+        lats, lons = _capLattice(index, total)
+        count = len(lats)
+
+        if count >= samples:
+            break
+
+        acceptance = count / float(total) if count else acceptance / 16.
+
+    if count < samples:
+        raise ValueError("region_points_uniform found too few points inside the polygons, do they enclose any area?")
+
+    keep = np.round(np.linspace(0, count - 1, samples)).astype(np.int64)
+
+    return _normaliseLatLon(lats[keep], lons[keep])
+
+
+def _latticePoints(samples, lon_min, lon_width, sin_min, sin_max):
+
+    golden = (np.sqrt(5) - 1) / 2
+    i = np.arange(samples)
+
+    lats = np.degrees(np.arcsin(sin_min + (sin_max - sin_min) * (i + 0.5) / samples))
+    lons = lon_min + lon_width * ((i * golden) % 1.0)
+
+    return lats, lons
+
+
+def _boxExtent(boundingBox):
+
+    lon_1, lon_2, lat_1, lat_2 = [float(value) for value in boundingBox]
+
+    if lat_1 > lat_2:
+        raise ValueError("Bounding box southern latitude is north of northern latitude: " + str(boundingBox))
+
+    # A box whose second longitude is east of the first wraps through the antimeridian
+    lon_width = lon_2 - lon_1 if lon_2 >= lon_1 else lon_2 - lon_1 + 360.
+
+    return lon_1, lon_width, np.sin(np.radians(lat_1)), np.sin(np.radians(lat_2))
+
+
+def _normaliseLatLon(lats, lons):
+
+    lats, lons = checkLatLon(lats, (lons + 180.) % 360. - 180.)
+
+    return lats, lons
+
+
+# Largest set of cap lattice points region_points_uniform will test against polygons
+_MAX_LATTICE_POINTS = 2**25
+
+# Largest cap lattice region_points_uniform grows while finding no points inside the polygons
+_MAX_EMPTY_LATTICE_POINTS = 2**20
+
+# Times region_points_uniform resizes its cap lattices to fit the polygons before giving up
+_MAX_LATTICE_REFINEMENTS = 8
+
+# Consecutive batches without a point inside the polygons before giving up on sampling them
+_MAX_EMPTY_BATCHES = 8
+
+
+def _capPoints(index, choice, rng):
+
+    # Uniform points in each chosen polygon's bounding cap (the whole sphere for polygons without one)
+    count = len(choice)
+    cos_radius = index["cos_radius"][choice]
+
+    depth = rng.uniform(cos_radius, 1.)
+    azimuth = 2 * np.pi * rng.random(count)
+
+    return _capXYZ(index, choice, depth, azimuth)
+
+
+def _capLattice(index, total):
+
+    # Spiral lattices of about total points over the polygon caps, at the same density in every cap, keeping the
+    # points whose first containing polygon is the one the cap belongs to
+    cap_area = 1. - index["cos_radius"]
+    counts = np.ceil(total * cap_area / cap_area.sum()).astype(np.int64)
+
+    choice = np.repeat(np.arange(len(counts)), counts)
+    i = _segmentIndex(np.zeros(len(counts), dtype=np.int64), counts)
+
+    golden = (np.sqrt(5) - 1) / 2
+    depth = 1. - cap_area[choice] * (i + 0.5) / counts[choice]
+    azimuth = 2 * np.pi * ((i * golden) % 1.0)
+
+    lats, lons = _xyzToLatLon(*_capXYZ(index, choice, depth, azimuth))
+
+    accepted = np.concatenate([_firstPolygon(index, lats[start:start + 2**18], lons[start:start + 2**18]) ==
+                               choice[start:start + 2**18] for start in range(0, len(choice), 2**18)])
+
+    return lats[accepted], lons[accepted]
+
+
+def _capXYZ(index, choice, depth, azimuth):
+
+    ring = np.sqrt(np.maximum(1. - depth * depth, 0.))
+
+    points = (depth[:, None] * index["centre"][choice] + (ring * np.cos(azimuth))[:, None] * index["e1"][choice] +
+              (ring * np.sin(azimuth))[:, None] * index["e2"][choice])
+
+    return points[:, 0], points[:, 1], points[:, 2]
 
 
-""" PALAEOMAGNETICS """
 """
-    calcKfromA95
+    checkLatLon
 
-    Calculate koenigsberger ratio (k) from alpha 95 confidence limit (A95) and number of samples (n).
-    Returns k
+    Simple function to check incoming lat and lon are within correct ranges. Works on scalars or arrays.
 """
-def calcKfromA95(alpha95, n):
+def checkLatLon(lat, lon):
+
+    lat = np.asarray(lat)
+    lon = np.asarray(lon)
+
+    lon_corrected = np.where(lon > 180, -360 + lon, np.where(lon < -180, lon + 360, lon))
+    lat_corrected = np.where(lat > 90, -180 + lat, np.where(lat < -90, lat + 180, lat))
+
+    return lat_corrected[()], lon_corrected[()]
+
+
+"""
+    buildPolygonIndex
+
+    Precompute the spatial index used by partitionPoints. polygons is an iterable of pygplates features (every
+    PolygonOnSphere geometry is indexed with the feature's reconstruction plate ID, e.g. filterGPML output of static
+    or continental polygons) and / or (plateID, lats, lons) tuples of polygon vertices in degrees. Each polygon gets
+    a bounding cap, and the caps are bucketed in a coarse lat / lon grid so points are only tested against nearby
+    polygons. In a gnomonic projection about its cap centre (where polygon edges are straight lines) each polygon
+    gets a grid of bands bucketing its edges, so crossing tests only visit the edges near each point. Polygons too
+    wide to project (cap radius of 89 degrees or more) are tested with great circle arc crossings in 3D instead,
+    taking the antipode of their boundary centroid as a point outside them.
+    Returns dictionary of packed index arrays
+"""
+def buildPolygonIndex(polygons):
+
+    entries = []
+
+    for polygon in polygons:
+
+        if isinstance(polygon, tuple):
+            entries.append(polygon)
+            continue
+
+        plate_id = polygon.get_reconstruction_plate_id()
+
+        for geometry in polygon.get_all_geometries():
+
+            if isinstance(geometry, pgp.PolygonOnSphere):
+                vertices = geometry.to_lat_lon_array()
+                entries.append((plate_id, vertices[:, 0], vertices[:, 1]))
+
+    return _packPolygons(entries)
+
+
+"""
+    partitionPoints
+
+    Assign points (lat / lon arrays in degrees) to the polygon containing them. polygons is anything accepted by
+    buildPolygonIndex, or an index it returned (so it can be reused between calls). Points are processed in chunks
+    of chunk_size across a pool of processes. Where polygons overlap the first one wins.
+    Returns array of plate IDs, with missing for points outside every polygon
+"""
+def partitionPoints(polygons, lats, lons, processes=None, missing=-1, chunk_size=2**18):
+
+    index = polygons if _isPolygonIndex(polygons) else buildPolygonIndex(polygons)
+
+    lats = np.asarray(lats, dtype=np.float64).ravel()
+    lons = np.asarray(lons, dtype=np.float64).ravel()
+    chunks = [slice(start, start + chunk_size) for start in range(0, len(lats), chunk_size)]
+
+    if processes == 1 or len(chunks) <= 1:
+
+        results = [_partitionChunk(index, lats[chunk], lons[chunk], missing) for chunk in chunks]
+
+    else:
+
+        pool = multiprocessing.Pool(processes, initializer=_partitionInit, initargs=(index,))
+
+        try:
+            results = pool.map(_partitionWorker, [(lats[chunk], lons[chunk], missing) for chunk in chunks])
+        finally:
+            pool.close()
+            pool.join()
+
+    if not results:
+        return np.empty(0, dtype=np.int64)
+
+    return np.concatenate(results)
+
+
+# Caps wider than this cannot be projected gnomonically and are tested in 3D instead
+_MAX_CAP_RADIUS = 89.
+
+# Cell size (degrees) of the lat / lon grid bucketing polygon caps
+_CAP_GRID_STEP = 5.
+
+
+def _isPolygonIndex(polygons):
+
+    return isinstance(polygons, dict) and "cell_offsets" in polygons
+
+
+def _latLonToXYZ(lats, lons):
+
+    lats = np.radians(lats)
+    lons = np.radians(lons)
+
+    return np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats)
+
+
+def _xyzToLatLon(x, y, z):
+
+    return np.degrees(np.arcsin(np.clip(z, -1., 1.))), np.degrees(np.arctan2(y, x))
+
+
+def _segmentIndex(starts, counts):
+
+    # Flat indices of the ranges [starts[i], starts[i] + counts[i]) one after another
+    return np.repeat(starts, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+
+def _bandIndex(first, spans, n_bands):
+
+    # CSR buckets of items spanning bands first .. first + spans - 1 (wrapping past the last band)
+    items = np.repeat(np.arange(len(first)), spans)
+    bands = (np.repeat(first, spans) + _segmentIndex(np.zeros(len(spans), dtype=np.int64), spans)) % n_bands
+
+    order = np.argsort(bands, kind="mergesort")
+    band_offsets = np.zeros(n_bands + 1, dtype=np.int64)
+    band_offsets[1:] = np.cumsum(np.bincount(bands, minlength=n_bands))
+
+    return band_offsets, items[order]
+
+
+def _tangentBasis(centre):
+
+    pole = np.array([0., 0., 1.]) if abs(centre[2]) < 0.9 else np.array([1., 0., 0.])
+    e1 = np.cross(pole, centre)
+    e1 /= np.sqrt(np.dot(e1, e1))
+
+    return e1, np.cross(centre, e1)
+
+
+def _packPolygons(entries):
+
+    n_polygons = len(entries)
+
+    index = {
+        "plate_id": np.array([entry[0] for entry in entries], dtype=np.int64),
+        "large": np.zeros(n_polygons, dtype=bool),
+        "cos_radius": np.full(n_polygons, -1.),
+        "centre": np.tile([0., 0., 1.], (n_polygons, 1)),
+        "e1": np.tile([1., 0., 0.], (n_polygons, 1)),
+        "e2": np.tile([0., 1., 0.], (n_polygons, 1)),
+        "v_min": np.zeros(n_polygons),
+        "band_height": np.ones(n_polygons),
+        "band_start": np.zeros(n_polygons, dtype=np.int64),
+        "n_bands": np.zeros(n_polygons, dtype=np.int64),
+        "large_polygons": {},
+    }
+
+    edges = [[], [], [], []]
+    band_offsets = [np.zeros(1, dtype=np.int64)]
+    band_edges = []
+    n_edges = 0
+    n_band_total = 0
+
+    for k, (plate_id, lats, lons) in enumerate(entries):
+
+        vertices = np.column_stack(_latLonToXYZ(np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)))
+        centre = _boundaryCentroid(vertices)
+        norm = np.sqrt(np.dot(centre, centre))
+
+        if norm > 1e-9:
+            centre /= norm
+            cos_radius = np.min(vertices.dot(centre))
+
+        if norm <= 1e-9 or cos_radius < np.cos(np.radians(_MAX_CAP_RADIUS)):
+            index["large"][k] = True
+            index["large_polygons"][k] = _indexLargePolygon(vertices, centre if norm > 1e-9 else None)
+            continue
+
+        e1, e2 = _tangentBasis(centre)
+
+        # Gnomonic projection about the cap centre
+        depth = vertices.dot(centre)
+        u = vertices.dot(e1) / depth
+        v = vertices.dot(e2) / depth
+        u1, v1 = np.roll(u, -1), np.roll(v, -1)
+
+        # Bucket edges into bands of projected v
+        n_bands = max(1, len(u))
+        v_min = v.min()
+        band_height = max((v.max() - v_min) / n_bands, 1e-12)
+
+        first = np.clip(((np.minimum(v, v1) - v_min) / band_height).astype(np.int64), 0, n_bands - 1)
+        last = np.clip(((np.maximum(v, v1) - v_min) / band_height).astype(np.int64), 0, n_bands - 1)
+        local_offsets, local_edges = _bandIndex(first, last - first + 1, n_bands)
+
+        index["cos_radius"][k] = cos_radius
+        index["centre"][k] = centre
+        index["e1"][k] = e1
+        index["e2"][k] = e2
+        index["v_min"][k] = v_min
+        index["band_height"][k] = band_height
+        index["band_start"][k] = n_band_total
+        index["n_bands"][k] = n_bands
+
+        for column, values in zip(edges, [u, v, u1, v1]):
+            column.append(values)
+
+        band_offsets.append(local_offsets[1:] + band_offsets[-1][-1])
+        band_edges.append(local_edges + n_edges)
+        n_edges += len(u)
+        n_band_total += n_bands
+
+    index["edges"] = tuple(np.concatenate(column) if column else np.empty(0) for column in edges)
+    index["band_offsets"] = np.concatenate(band_offsets)
+    index["band_edges"] = np.concatenate(band_edges) if band_edges else np.empty(0, dtype=np.int64)
+    index["cell_offsets"], index["cell_polygons"] = _capGrid(index)
+
+    return index
+
+
+def _boundaryCentroid(vertices):
+
+    # Edge midpoints weighted by edge length, so the centroid does not depend on how densely edges are sampled
+    midpoints = vertices + np.roll(vertices, -1, axis=0)
+    lengths = np.sqrt((midpoints * midpoints).sum(axis=1))
+    arcs = 2 * np.arctan2(np.sqrt(((vertices - np.roll(vertices, -1, axis=0)) ** 2).sum(axis=1)), lengths)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        midpoints = np.where(lengths[:, None] > 0, midpoints / lengths[:, None], 0.)
+
+    return (midpoints * arcs[:, None]).sum(axis=0)
+
+
+def _capGrid(index):
+
+    # Bucket the caps of projectable polygons in lat / lon cells, using the lat / lon bounding box of each cap
+    n_lat = int(round(180. / _CAP_GRID_STEP))
+    n_lon = int(round(360. / _CAP_GRID_STEP))
+    polygons = np.nonzero(~index["large"])[0]
+
+    cap_lats, cap_lons = _xyzToLatLon(*index["centre"][polygons].T)
+    radius = np.degrees(np.arccos(np.clip(index["cos_radius"][polygons], -1., 1.))) + 1e-6
+
+    lat_first = np.clip(np.floor((cap_lats - radius + 90.) / _CAP_GRID_STEP), 0, n_lat - 1).astype(np.int64)
+    lat_last = np.clip(np.floor((cap_lats + radius + 90.) / _CAP_GRID_STEP), 0, n_lat - 1).astype(np.int64)
+
+    polar = (cap_lats + radius >= 90.) | (cap_lats - radius <= -90.)
+
+    with np.errstate(invalid="ignore"):
+        half_width = np.degrees(np.arcsin(np.clip(np.sin(np.radians(radius)) / np.cos(np.radians(cap_lats)), -1., 1.)))
+
+    lon_first = np.floor((cap_lons - half_width + 180.) / _CAP_GRID_STEP).astype(np.int64)
+    lon_spans = np.floor((cap_lons + half_width + 180.) / _CAP_GRID_STEP).astype(np.int64) - lon_first + 1
+    lon_first = np.where(polar, 0, lon_first % n_lon)
+    lon_spans = np.where(polar, n_lon, np.minimum(lon_spans, n_lon))
+
+    # Every (polygon, lat cell) row, then every lon cell along it
+    lat_spans = lat_last - lat_first + 1
+    row_polygon = np.repeat(np.arange(len(polygons)), lat_spans)
+    row_lat = np.repeat(lat_first, lat_spans) + _segmentIndex(np.zeros(len(polygons), dtype=np.int64), lat_spans)
+
+    cell_polygon = np.repeat(row_polygon, lon_spans[row_polygon])
+    cell_lon = (np.repeat(lon_first[row_polygon], lon_spans[row_polygon]) +
+                _segmentIndex(np.zeros(len(row_polygon), dtype=np.int64), lon_spans[row_polygon])) % n_lon
+    cells = np.repeat(row_lat, lon_spans[row_polygon]) * n_lon + cell_lon
+
+    # Polygons stay in index order within a cell, so the first match found for a point is the lowest index
+    order = np.lexsort((polygons[cell_polygon], cells))
+    cell_offsets = np.zeros(n_lat * n_lon + 1, dtype=np.int64)
+    cell_offsets[1:] = np.cumsum(np.bincount(cells, minlength=n_lat * n_lon))
+
+    return cell_offsets, polygons[cell_polygon][order]
+
+
+def _pointCells(lats, lons):
+
+    n_lat = int(round(180. / _CAP_GRID_STEP))
+    n_lon = int(round(360. / _CAP_GRID_STEP))
+
+    lat_cell = np.clip(np.floor((lats + 90.) / _CAP_GRID_STEP), 0, n_lat - 1).astype(np.int64)
+    lon_cell = np.clip(np.floor(((lons + 180.) % 360.) / _CAP_GRID_STEP), 0, n_lon - 1).astype(np.int64)
+
+    return lat_cell * n_lon + lon_cell
+
+
+def _indexLargePolygon(vertices, centroid):
+
+    # Arcs from each point to a reference point outside the polygon are tested for crossings with the polygon edges.
+    # Edges are bucketed by their span of azimuth about the reference point, the azimuth of the point's arc.
+    reference = -centroid if centroid is not None else np.array([0., 0., -1.])
+    f1, f2 = _tangentBasis(reference)
+
+    start = vertices
+    end = np.roll(vertices, -1, axis=0)
+
+    azimuth_start = np.arctan2(start.dot(f2), start.dot(f1)) % (2 * np.pi)
+    azimuth_end = np.arctan2(end.dot(f2), end.dot(f1)) % (2 * np.pi)
+    sweep = (azimuth_end - azimuth_start) % (2 * np.pi)
+
+    band_from = np.where(sweep <= np.pi, azimuth_start, azimuth_end)
+    band_width = np.minimum(sweep, 2 * np.pi - sweep)
+
+    n_bands = max(1, len(vertices))
+    band_size = 2 * np.pi / n_bands
+    first = np.floor(band_from / band_size).astype(np.int64)
+    spans = np.minimum(np.floor((band_from + band_width) / band_size).astype(np.int64) - first + 1, n_bands)
+    band_offsets, band_edges = _bandIndex(first % n_bands, spans, n_bands)
+
+    return {"reference": reference, "basis": (f1, f2), "start": start, "end": end, "normal": np.cross(start, end),
+            "band_size": band_size, "band_offsets": band_offsets, "band_edges": band_edges}
+
+
+def _containsPairs(index, x, y, z, polygon):
+
+    # Is point (x, y, z)[i] inside polygon[i], for every pair i
+    inside = np.zeros(len(x), dtype=bool)
+    large = index["large"][polygon]
+
+    for k in np.unique(polygon[large]):
+        members = np.nonzero(polygon == k)[0]
+        inside[members] = _containsLarge(index["large_polygons"][k], x[members], y[members], z[members])
+
+    # Bounding cap rejection first, then crossing tests for the candidates left
+    centre = index["centre"][polygon]
+    depth = x * centre[:, 0] + y * centre[:, 1] + z * centre[:, 2]
+    candidates = np.nonzero(~large & (depth >= index["cos_radius"][polygon] - 1e-12))[0]
+
+    if len(candidates) == 0:
+        return inside
+
+    cand_polygon = polygon[candidates]
+    cx, cy, cz, depth = x[candidates], y[candidates], z[candidates], depth[candidates]
+    e1 = index["e1"][cand_polygon]
+    e2 = index["e2"][cand_polygon]
+    pu = (cx * e1[:, 0] + cy * e1[:, 1] + cz * e1[:, 2]) / depth
+    pv = (cx * e2[:, 0] + cy * e2[:, 1] + cz * e2[:, 2]) / depth
+
+    n_bands = index["n_bands"][cand_polygon]
+    band = np.floor((pv - index["v_min"][cand_polygon]) / index["band_height"][cand_polygon]).astype(np.int64)
+    in_range = (band >= 0) & (band < n_bands)
+    band = index["band_start"][cand_polygon] + np.clip(band, 0, n_bands - 1)
+
+    # One (candidate, edge) pair for every edge in the candidate's band
+    band_offsets = index["band_offsets"]
+    starts = band_offsets[band]
+    counts = np.where(in_range, band_offsets[band + 1] - starts, 0)
+    pairs = np.repeat(np.arange(len(candidates)), counts)
+    edges = index["band_edges"][_segmentIndex(starts, counts)]
+
+    u0, v0, u1, v1 = [array[edges] for array in index["edges"]]
+    pair_u, pair_v = pu[pairs], pv[pairs]
+
+    straddles = (v0 > pair_v) != (v1 > pair_v)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        crossing = straddles & (u0 + (pair_v - v0) * (u1 - u0) / (v1 - v0) > pair_u)
+
+    crossings = np.bincount(pairs, weights=crossing, minlength=len(candidates))
+    inside[candidates] = crossings % 2 == 1
+
+    return inside
+
+
+def _containsLarge(entry, x, y, z):
+
+    points = np.column_stack((x, y, z))
+    reference = entry["reference"]
+    f1, f2 = entry["basis"]
+
+    azimuth = np.arctan2(points.dot(f2), points.dot(f1)) % (2 * np.pi)
+    n_bands = len(entry["band_offsets"]) - 1
+    band = np.floor(azimuth / entry["band_size"]).astype(np.int64) % n_bands
+
+    starts = entry["band_offsets"][band]
+    counts = entry["band_offsets"][band + 1] - starts
+    pairs = np.repeat(np.arange(len(points)), counts)
+    edges = entry["band_edges"][_segmentIndex(starts, counts)]
+
+    point = points[pairs]
+    start = entry["start"][edges]
+    end = entry["end"][edges]
+    edge_normal = entry["normal"][edges]
+
+    # The great circle arcs point - reference and start - end cross if each straddles the other's great circle
+    # and the crossing of the two great circles lies on the same side for both arcs
+    arc_normal = np.cross(point, reference)
+    straddles = (start * arc_normal).sum(axis=1) * (end * arc_normal).sum(axis=1) < 0
+    straddles &= (point * edge_normal).sum(axis=1) * edge_normal.dot(reference) < 0
+
+    crossing_point = np.cross(arc_normal, edge_normal)
+    same_side = np.sign((crossing_point * (start + end)).sum(axis=1)) == np.sign((crossing_point * (point + reference)).sum(axis=1))
+
+    crossings = np.bincount(pairs, weights=straddles & same_side, minlength=len(points))
+
+    return crossings % 2 == 1
+
+
+_partition_index = None
+
+
+def _partitionInit(index):
+
+    global _partition_index
+    _partition_index = index
+
+
+def _partitionWorker(task):
+
+    return _partitionChunk(_partition_index, *task)
+
+
+def _partitionChunk(index, lats, lons, missing):
+
+    best = _firstPolygon(index, lats, lons)
+    n_polygons = len(index["plate_id"])
+
+    plate_ids = np.full(len(lats), missing, dtype=np.int64)
+    found = best < n_polygons
+    plate_ids[found] = index["plate_id"][best[found]]
+
+    return plate_ids
+
+
+def _firstPolygon(index, lats, lons):
+
+    # Index of the first polygon containing each point, or the number of polygons for points outside them all
+    x, y, z = _latLonToXYZ(lats, lons)
+    n_polygons = len(index["plate_id"])
+    best = np.full(len(lats), n_polygons, dtype=np.int64)
+
+    # Candidate (point, polygon) pairs from the polygons whose caps overlap the point's grid cell
+    cells = _pointCells(lats, lons)
+    starts = index["cell_offsets"][cells]
+    counts = index["cell_offsets"][cells + 1] - starts
+    pair_point = np.repeat(np.arange(len(lats)), counts)
+    pair_polygon = index["cell_polygons"][_segmentIndex(starts, counts)]
+
+    inside = _containsPairs(index, x[pair_point], y[pair_point], z[pair_point], pair_polygon)
+
+    # Pairs are ordered by point then polygon, so the first inside pair of a point is its lowest polygon index
+    points, first = np.unique(pair_point[inside], return_index=True)
+    best[points] = pair_polygon[inside][first]
+
+    for k, entry in index["large_polygons"].items():
+        best = np.where(_containsLarge(entry, x, y, z), np.minimum(best, k), best)
+
+    return best
+
+
+"""
+
+    featureScaling
+
+    Normalise dataset using feature scaling. Scaling is nan-aware and vectorised; axis selects per-axis scaling
+    (e.g. axis=0 scales each column independently) and data_range supplies a precomputed (min, max) pair such as
+    the one returned by scalingRange or updateScalingRange. With inplace=True a floating point array (or writable
+    np.memmap) is overwritten rather than copied.
+"""
+def featureScaling(data, axis=None, inplace=False, data_range=None):
+
+    if inplace:
+
+        if not isinstance(data, np.ndarray) or not np.issubdtype(data.dtype, np.floating):
+            raise TypeError("In place feature scaling requires a floating point numpy array")
+
+        norm_data = data
+
+    else:
+
+        norm_data = np.array(data, dtype=np.float64)
+
+    if data_range is None:
+        min_data, max_data = updateScalingRange(norm_data, axis=axis)
+    else:
+        min_data, max_data = data_range
+
+    norm_data -= min_data
+    norm_data /= (max_data - min_data)
+
+    return norm_data
+
+
+"""
+    updateScalingRange
+
+    Online (incremental) update of the nan-aware min / max used by featureScaling. Pass each new chunk of a growing
+    dataset together with the previous (min, max) pair; the first call should leave data_range as None.
+    Returns (min, max) with reduced axes kept so they broadcast against the data.
+"""
+def updateScalingRange(chunk, data_range=None, axis=None):
+
+    chunk = np.asarray(chunk)
+
+    # All-nan slices simply contribute nothing to the running range
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        min_chunk = np.nanmin(chunk, axis=axis, keepdims=True)
+        max_chunk = np.nanmax(chunk, axis=axis, keepdims=True)
+
+    if data_range is None:
+        return min_chunk, max_chunk
+
+    return np.fmin(data_range[0], min_chunk), np.fmax(data_range[1], max_chunk)
+
+
+"""
+    scalingRange
+
+    First pass of out-of-core feature scaling. Returns the nan-aware (min, max) of data, which may be a numpy array /
+    np.memmap (read in blocks of rows holding at most memory_budget bytes as float64), a sequence of chunks split
+    along the first axis, or a zero-argument callable returning a fresh iterator of such chunks.
+"""
+def scalingRange(data, axis=None, memory_budget=2**27):
+
+    data_range = None
+
+    for chunk in _chunkSource(data, memory_budget)():
+        data_range = updateScalingRange(chunk, data_range, axis=_chunkAxis(chunk, axis))
+
+    return data_range
+
+
+"""
+    featureScalingChunked
+
+    Out-of-core feature scaling for datasets too large to hold in memory. data may be a numpy array / np.memmap (read
+    in blocks of rows holding at most memory_budget bytes as float64), a sequence of chunks split along the first
+    axis, or a zero-argument callable returning a fresh iterator of chunks. A first pass finds the nan-aware
+    min / max, a second pass scales each chunk. A one-shot iterator can only be read once, so it is accepted only when
+    data_range is given or axis does not include the first axis (every chunk is then scaled on its own in a single
+    pass); otherwise pass a callable. Scaled chunks are written consecutively into out, a floating point array (pass
+    data itself to scale a writable np.memmap in place), and out is returned; if out is None a generator of scaled
+    chunks is returned instead.
+"""
+def featureScalingChunked(data, out=None, axis=None, memory_budget=2**27, data_range=None):
+
+    if out is not None and (not isinstance(out, np.ndarray) or not np.issubdtype(out.dtype, np.floating)):
+        raise TypeError("Chunked feature scaling into out requires a floating point numpy array")
+
+    source = _chunkSource(data, memory_budget)
+    chunks = source()
+
+    # Look at the first chunk to resolve axis, then put it back in front of the remaining chunks
+    first = next(chunks, None)
+
+    if first is None:
+        return out if out is not None else iter([])
+
+    chunks = itertools.chain([first], chunks)
+
+    if data_range is None and _reducesFirstAxis(first.ndim, axis):
+
+        if _isOneShot(data):
+            raise ValueError("Scaling over the first axis needs two passes: pass an array, a sequence of chunks or a "
+                             "callable returning a fresh iterator of chunks, not a one-shot iterator")
+
+        data_range = scalingRange(data, axis=axis, memory_budget=memory_budget)
+
+    scaled = _scaleChunks(chunks, axis, data_range)
+
+    if out is None:
+        return scaled
+
+    row = 0
+
+    for chunk in scaled:
+        out[row:row + len(chunk)] = chunk
+        row += len(chunk)
+
+    if isinstance(out, np.memmap):
+        out.flush()
+
+    return out
+
+
+def _scaleChunks(chunks, axis, data_range):
+
+    for chunk in chunks:
+
+        if data_range is None:
+            yield featureScaling(chunk, axis=_chunkAxis(chunk, axis))
+        else:
+            yield featureScaling(chunk, data_range=data_range)
+
+
+def _isOneShot(data):
+
+    return not isinstance(data, np.ndarray) and not callable(data) and iter(data) is data
+
+
+def _chunkSource(data, memory_budget):
+
+    # Returns a callable giving a fresh iterator of chunks on every call (where data allows it)
+    if isinstance(data, np.ndarray):
+
+        if data.ndim == 0:
+            return lambda: iter([data])
+
+        # Rows per chunk from the float64 size of one row, so scaled copies stay within the budget
+        row_nbytes = max(1, data[:1].size) * max(data.dtype.itemsize, 8)
+        rows = int(max(1, memory_budget // row_nbytes))
+
+        return lambda: (data[start:start + rows] for start in range(0, len(data), rows))
+
+    if callable(data):
+        return lambda: (np.asarray(chunk) for chunk in data())
+
+    return lambda: (np.asarray(chunk) for chunk in data)
+
+
+def _chunkAxis(chunk, axis):
+
+    # Normalise negative axes against the chunk so reductions line up between chunks
+    if axis is None:
+        return None
+
+    if np.ndim(axis) == 0:
+        return axis % chunk.ndim
+
+    return tuple(a % chunk.ndim for a in axis)
+
+
+def _reducesFirstAxis(ndim, axis):
+
+    if axis is None:
+        return True
+
+    axes = [axis] if np.ndim(axis) == 0 else list(axis)
+
+    return any(a % max(ndim, 1) == 0 for a in axes)
+
+
+
+
+""" PALAEOMAGNETICS """
+"""
+    calcKfromA95
+
+    Calculate koenigsberger ratio (k) from alpha 95 confidence limit (A95) and number of samples (n).
+    alpha95 and n broadcast against each other; entries with n <= 1 are undefined and returned as nan.
+    Returns k
+"""
+def calcKfromA95(alpha95, n):
+
+    alpha95, n = np.broadcast_arrays(np.asarray(alpha95, dtype=np.float64), np.asarray(n, dtype=np.float64))
+    valid = n > 1
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+
+        alpha95 = np.radians(alpha95)
+        fac = 20.**(1. / np.where(valid, n - 1, np.nan))
+        r2 = 1. / (fac - np.cos(alpha95))
+        r2 = r2 * n * (fac - 1.)
+        k = (n - 1.) / (n - r2)
+
+    k = np.where(valid, k, np.nan)
+
+    return k[()]
+
+
+"""
+    calcVGP
+
+    Calculate virtual geomagnetic poles from site latitude / longitude and declination / inclination (degrees).
+    All inputs broadcast against each other, so millions of sites can be converted in one call. If alpha95 is
+    given the semi-axes of the confidence ellipse (dp, dm) are also returned, otherwise they are None.
+    Returns pole latitude, pole longitude (-180 - 180), dp, dm, palaeolatitude
+"""
+def calcVGP(site_lat, site_lon, dec, inc, alpha95=None):
+
+    slat = np.radians(site_lat)
+    slon = np.radians(site_lon)
+    dec = np.radians(dec)
+    inc = np.radians(inc)
+
+    # Magnetic colatitude from the dipole formula
+    p = np.arctan2(2., np.tan(inc))
+
+    plat = np.arcsin(np.clip(np.sin(slat) * np.cos(p) + np.cos(slat) * np.sin(p) * np.cos(dec), -1., 1.))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        beta = np.arcsin(np.clip(np.sin(p) * np.sin(dec) / np.cos(plat), -1., 1.))
+
+    plon = np.where(np.cos(p) >= np.sin(slat) * np.sin(plat), slon + beta, slon + np.pi - beta)
+    pole_lat, pole_lon = checkLatLon(np.degrees(plat), np.degrees(plon) % 360.)
+
+    palaeolat = np.degrees(np.arctan(np.tan(inc) / 2.))
+
+    if alpha95 is None:
+        return pole_lat, pole_lon, None, None, palaeolat
+
+    dp = alpha95 * (1. + 3. * np.cos(p) ** 2) / 2.
+
+    with np.errstate(divide="ignore"):
+        dm = alpha95 * np.sin(p) / np.cos(inc)
+
+    return pole_lat, pole_lon, dp[()], dm[()], palaeolat
+
+
+"""
+    calcVGPChunked
+
+    calcVGP for 1D inputs too large for memory (e.g. np.memmap), processed chunk_size records at a time. Scalar
+    inputs (a single site, or one alpha95 for all records) are broadcast against the arrays.
+    Results are written into out, a sequence of five writable arrays (pole lat, pole lon, dp, dm, palaeolat) which
+    may themselves be np.memmap files; dp / dm entries may be None when alpha95 is not given. New arrays are
+    allocated if out is None.
+    Returns pole latitude, pole longitude, dp, dm, palaeolatitude
+"""
+def calcVGPChunked(site_lat, site_lon, dec, inc, alpha95=None, out=None, chunk_size=2**20):
+
+    # Scalars (e.g. a single site or one alpha95 for every record) are broadcast without copying
+    length = max(np.size(value) for value in [site_lat, site_lon, dec, inc, alpha95] if value is not None)
+    site_lat, site_lon, dec, inc = [_broadcastRecords(value, length) for value in [site_lat, site_lon, dec, inc]]
+
+    if alpha95 is not None:
+        alpha95 = _broadcastRecords(alpha95, length)
+
+    if out is None:
+        out = [np.empty(length) for i in range(5)]
+
+        if alpha95 is None:
+            out[2] = out[3] = None
+
+    for start in range(0, length, chunk_size):
+
+        chunk = slice(start, start + chunk_size)
+        results = calcVGP(site_lat[chunk], site_lon[chunk], dec[chunk], inc[chunk],
+                          None if alpha95 is None else alpha95[chunk])
+
+        for array, result in zip(out, results):
+
+            if array is not None and result is not None:
+                array[chunk] = result
+
+    for array in out:
+
+        if isinstance(array, np.memmap):
+            array.flush()
+
+    return tuple(out)
+
+
+def _broadcastRecords(value, length):
+
+    if np.ndim(value) == 0:
+        return np.broadcast_to(np.asarray(value, dtype=np.float64), (length,))
+
+    return value
+
+
+"""
+    dir2cart
+
+    Convert declination / inclination (degrees) and optional intensity to cartesian x, y, z. Broadcasts over arrays.
+"""
+def dir2cart(dec, inc, intensity=1.):
+
+    dec = np.radians(dec)
+    inc = np.radians(inc)
+
+    x = intensity * np.cos(dec) * np.cos(inc)
+    y = intensity * np.sin(dec) * np.cos(inc)
+    z = intensity * np.sin(inc)
+
+    return x, y, z
+
+
+"""
+    cart2dir
+
+    Convert cartesian x, y, z to declination (0 - 360), inclination and length. Broadcasts over arrays.
+"""
+def cart2dir(x, y, z):
+
+    r = np.sqrt(x * x + y * y + z * z)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        inc = np.degrees(np.arcsin(np.clip(z / r, -1., 1.)))
+
+    dec = np.degrees(np.arctan2(y, x)) % 360.
+
+    return dec, inc, r
+
+
+"""
+    fisherMeanGrouped
+
+    Fisher (1953) statistics for many site groups at once. dec / inc are flat arrays of directions (degrees) and
+    groups a matching array of group labels (any sortable dtype). Directions are reduced per group with segmented
+    sums, so there is no Python loop over groups. Groups with n <= 1 have nan k and alpha95.
+    Returns dictionary of arrays: group, dec, inc, n, r, k, alpha95
+"""
+def fisherMeanGrouped(dec, inc, groups):
+
+    dec = np.asarray(dec, dtype=np.float64).ravel()
+    inc = np.asarray(inc, dtype=np.float64).ravel()
+    labels, group_index = np.unique(np.asarray(groups).ravel(), return_inverse=True)
+
+    if not (len(dec) == len(inc) == len(group_index)):
+        raise ValueError("dec, inc and groups must all be the same length")
+
+    x, y, z = dir2cart(dec, inc)
+
+    n_groups = len(labels)
+    n = np.bincount(group_index, minlength=n_groups).astype(np.float64)
+    xsum = np.bincount(group_index, weights=x, minlength=n_groups)
+    ysum = np.bincount(group_index, weights=y, minlength=n_groups)
+    zsum = np.bincount(group_index, weights=z, minlength=n_groups)
+
+    mean_dec, mean_inc, r = cart2dir(xsum, ysum, zsum)
+    k, alpha95 = _fisherKA95(n, r)
+
+    return {"group": labels, "dec": mean_dec, "inc": mean_inc, "n": n, "r": r, "k": k, "alpha95": alpha95}
+
+
+def _fisherKA95(n, r):
+
+    # Precision parameter and 95% confidence cone from sample count and resultant length
+    valid = n > 1
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+
+        k = np.where(valid, (n - 1.) / (n - r), np.nan)
+        a = 1. - (n - r) / r * (20.**(1. / np.where(valid, n - 1., np.nan)) - 1.)
+        alpha95 = np.where(valid, np.degrees(np.arccos(np.clip(a, -1., 1.))), np.nan)
+
+    return k, alpha95
+
+
+"""
+    bootstrapFisherMeans
+
+    Bootstrap pseudo-means of a set of directions (dec / inc) or poles (lon / lat), all in degrees. Resamples are
+    drawn as index arrays in batches and their Fisher means are computed vectorised over the resample axis. The
+    resamples are split into at least one task per process of a pool, and memory_budget (bytes) is shared between
+    the processes, bounding the batches they hold at once. Every fixed-size block of resamples has its own generator
+    spawned from seed, so results are reproducible for a given seed regardless of the number of processes or
+    memory_budget.
+    Returns arrays of nb bootstrap mean declinations and inclinations
+"""
+def bootstrapFisherMeans(dec, inc, nb=1000, seed=None, processes=None, memory_budget=2**28):
+
+    x, y, z = dir2cart(np.asarray(dec, dtype=np.float64).ravel(), np.asarray(inc, dtype=np.float64).ravel())
+    n = len(x)
+
+    if n == 0:
+        raise ValueError("bootstrapFisherMeans needs at least one direction")
+
+    if nb < 1:
+        raise ValueError("bootstrapFisherMeans needs nb >= 1 resamples: " + str(nb))
+
+    workers = 1 if processes == 1 else (processes or multiprocessing.cpu_count())
+
+    # Resample indices (int64) plus the three gathered coordinate arrays per resample, for each worker
+    batch_size = int(max(1, min(nb, memory_budget // workers // (32 * n))))
+
+    # Every fixed-size block of resamples draws from its own stream spawned from seed, so the output does not depend
+    # on how blocks are grouped into batches (memory_budget) or spread over processes
+    block_counts = [min(_BOOTSTRAP_BLOCK, nb - start) for start in range(0, nb, _BOOTSTRAP_BLOCK)]
+    blocks = list(zip(block_counts, np.random.SeedSequence(seed).spawn(len(block_counts))))
+    blocks_per_task = -(-len(blocks) // workers)
+    tasks = [(blocks[start:start + blocks_per_task], batch_size) for start in range(0, len(blocks), blocks_per_task)]
+
+    if processes == 1 or len(tasks) <= 1:
+
+        results = [_bootstrapBatch((x, y, z), task_blocks, task_batch_size) for task_blocks, task_batch_size in tasks]
+
+    else:
+
+        pool = multiprocessing.Pool(processes, initializer=_bootstrapInit, initargs=((x, y, z),))
+
+        try:
+            results = pool.map(_bootstrapWorker, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    boot_dec = np.concatenate([result[0] for result in results])
+    boot_inc = np.concatenate([result[1] for result in results])
+
+    return boot_dec, boot_inc
+
+
+"""
+    bootstrapConfidence
+
+    Confidence region from bootstrap pseudo-means (e.g. from bootstrapFisherMeans): the mean direction of the
+    pseudo-means and the angular radius (degrees) of the cone about it containing level percent of them.
+    Returns mean dec, mean inc, radius
+"""
+def bootstrapConfidence(boot_dec, boot_inc, level=95.):
+
+    x, y, z = dir2cart(boot_dec, boot_inc)
+    mean_dec, mean_inc, _ = cart2dir(np.sum(x), np.sum(y), np.sum(z))
+    mx, my, mz = dir2cart(mean_dec, mean_inc)
+
+    angles = np.degrees(np.arccos(np.clip(x * mx + y * my + z * mz, -1., 1.)))
+
+    return mean_dec, mean_inc, np.percentile(angles, level)
+
+
+# Resamples drawn from each spawned random stream
+_BOOTSTRAP_BLOCK = 64
+
+_bootstrap_data = None
+
+
+def _bootstrapInit(data):
+
+    global _bootstrap_data
+    _bootstrap_data = data
+
+
+def _bootstrapWorker(task):
+
+    return _bootstrapBatch(_bootstrap_data, *task)
+
+
+def _bootstrapBatch(data, blocks, batch_size):
+
+    boot_dec = []
+    boot_inc = []
+    pending = []
+    rows = 0
+
+    for count, seed_seq in blocks:
+
+        rng = np.random.default_rng(seed_seq)
+
+        # Only a block larger than the batch is drawn in several parts, row by row from the same stream
+        for start in range(0, count, batch_size):
+
+            size = min(batch_size, count - start)
+
+            # Blocks are gathered into batches of up to batch_size resamples before their means are computed
+            if pending and rows + size > batch_size:
+                dec, inc = _bootstrapMeans(data, pending)
+                boot_dec.append(dec)
+                boot_inc.append(inc)
+                pending = []
+                rows = 0
+
+            pending.append(rng.integers(0, len(data[0]), size=(size, len(data[0]))))
+            rows += size
+
+    dec, inc = _bootstrapMeans(data, pending)
+    boot_dec.append(dec)
+    boot_inc.append(inc)
+
+    return np.concatenate(boot_dec), np.concatenate(boot_inc)
+
+
+def _bootstrapMeans(data, indices):
 
-    alpha95 = np.radians(alpha95)
-    fac = 20.**(1. / (n - 1))
-    r2 = 1. / (fac - np.cos(alpha95))
-    r2 = r2 * n * (fac - 1.)
-    k = (n - 1.) / (n - r2)
+    x, y, z = data
+    index = np.concatenate(indices)
+    dec, inc, _ = cart2dir(x[index].sum(axis=1), y[index].sum(axis=1), z[index].sum(axis=1))
 
-    return k
+    return dec, inc